@@ -0,0 +1,238 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Points kept per line trace (downsampled with LTTB) and per trace of a
+# multi-trace scatter (subsampled).
+FIGURE_MAX_POINTS = int(os.getenv("AUTOANALYTX_FIGURE_MAX_POINTS", "5000"))
+# Marker-only scatters above this many points are drawn with WebGL.
+SCATTER_WEBGL_POINTS = 10_000
+# Scatters and histograms above this many points are binned on the server.
+BINNING_MIN_POINTS = 200_000
+DENSITY_BINS = 200
+HISTOGRAM_MAX_BINS = 200
+# Serialized size a figure may have after post-processing.
+FIGURE_MAX_BYTES = int(float(os.getenv("AUTOANALYTX_FIGURE_MAX_MB", "5")) * 1024 * 1024)
+MIN_POINTS = 500
+
+# Per-point attributes that must be subset along with x and y.
+_POINT_ATTRIBUTES = ("text", "hovertext", "customdata", "ids")
+_MARKER_ATTRIBUTES = ("color", "size", "symbol", "opacity")
+
+def _numeric(values) -> np.ndarray:
+    """Converts x values to floats for LTTB; datetimes become nanoseconds, anything else positions."""
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        return array.astype("datetime64[ns]").astype(np.int64).astype(float)
+    if np.issubdtype(array.dtype, np.number):
+        return array.astype(float)
+    return np.arange(len(array), dtype=float)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: picks `n` points of (x, y) that keep the
+    visual shape of the line. Returns their indices, first and last included.
+    """
+    length = len(y)
+    if n >= length or n < 3:
+        return np.arange(length)
+    edges = np.linspace(1, length - 1, n - 1).astype(int)
+    indices = np.empty(n, dtype=int)
+    indices[0], indices[-1] = 0, length - 1
+    previous = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next bucket's average is the third corner of the triangle
+        next_end = edges[i + 2] if i + 2 < len(edges) else length
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        indices[i + 1] = previous
+    return indices
+
+def _subset(trace: dict, indices: np.ndarray, length: int) -> dict:
+    trace = dict(trace)
+    for key in ("x", "y") + _POINT_ATTRIBUTES:
+        values = trace.get(key)
+        if values is not None and np.ndim(values) > 0 and len(values) == length:
+            trace[key] = np.asarray(values)[indices]
+    marker = trace.get("marker")
+    if isinstance(marker, dict):
+        marker = dict(marker)
+        for key in _MARKER_ATTRIBUTES:
+            values = marker.get(key)
+            if values is not None and np.ndim(values) > 0 and len(values) == length:
+                marker[key] = np.asarray(values)[indices]
+        trace["marker"] = marker
+    return trace
+
+def _downsample_line(trace: dict, max_points: int) -> dict:
+    y = np.asarray(trace["y"])
+    if np.issubdtype(y.dtype, np.number):
+        x = trace.get("x")
+        x = _numeric(x) if x is not None else np.arange(len(y), dtype=float)
+        indices = lttb_indices(x, np.nan_to_num(y.astype(float)), max_points)
+    else:
+        # Categorical values have no triangle areas; keep evenly spaced points
+        indices = np.unique(np.linspace(0, len(y) - 1, max_points).astype(int))
+    return _subset(trace, indices, len(y))
+
+def _subsample(trace: dict, max_points: int) -> dict:
+    """Keeps a random `max_points` of a marker scatter, in their original order."""
+    length = _points(trace)
+    rng = np.random.default_rng(0)
+    indices = np.sort(rng.choice(length, size=max_points, replace=False))
+    return _subset(trace, indices, length)
+
+def _axis_values(values) -> tuple:
+    """Returns (floats, is_datetime) for numeric or datetime values, or (None, False)."""
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        return array.astype("datetime64[ns]").astype(np.int64).astype(float), True
+    if np.issubdtype(array.dtype, np.number):
+        return array.astype(float), False
+    return None, False
+
+def _density(trace: dict):
+    """Bins a huge scatter into a 2D count heatmap on the server; returns None if it can't."""
+    x, x_dates = _axis_values(trace["x"]) if trace.get("x") is not None else (None, False)
+    y, y_dates = _axis_values(trace["y"])
+    if x is None or y is None:
+        return None
+    finite = np.isfinite(x) & np.isfinite(y)
+    counts, x_edges, y_edges = np.histogram2d(x[finite], y[finite], bins=DENSITY_BINS)
+    x_centers, y_centers = (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+    if x_dates:
+        x_centers = x_centers.astype(np.int64).astype("datetime64[ns]")
+    if y_dates:
+        y_centers = y_centers.astype(np.int64).astype("datetime64[ns]")
+    return {
+        "type": "heatmap",
+        "x": x_centers,
+        "y": y_centers,
+        # histogram2d counts are indexed [x, y]; heatmap rows are y
+        "z": np.where(counts.T > 0, counts.T, np.nan),
+        "colorscale": "Blues",
+        "colorbar": {"title": {"text": "points"}},
+        "name": trace.get("name"),
+        "xaxis": trace.get("xaxis"),
+        "yaxis": trace.get("yaxis"),
+    }
+
+def _prebin_histogram(trace: dict):
+    """Bins a plain numeric count histogram on the server; returns None if it can't."""
+    if trace.get("histfunc") not in (None, "count") or trace.get("histnorm") or trace.get("y") is not None:
+        return None
+    values = np.asarray(trace["x"])
+    if not np.issubdtype(values.dtype, np.number):
+        return None
+    values = values[np.isfinite(values)]
+    bins = min(trace.get("nbinsx") or HISTOGRAM_MAX_BINS, HISTOGRAM_MAX_BINS)
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "type": "bar",
+        "x": (edges[:-1] + edges[1:]) / 2,
+        "y": counts,
+        "width": np.diff(edges),
+        "name": trace.get("name"),
+        "marker": trace.get("marker"),
+        "xaxis": trace.get("xaxis"),
+        "yaxis": trace.get("yaxis"),
+    }
+
+def _points(trace: dict) -> int:
+    for key in ("y", "x"):
+        values = trace.get(key)
+        if values is not None and np.ndim(values) > 0:
+            return len(values)
+    return 0
+
+def _is_marker_scatter(trace: dict) -> bool:
+    return (
+        trace.get("type", "scatter") in ("scatter", "scattergl")
+        and trace.get("y") is not None
+        and "lines" not in (trace.get("mode") or "lines")
+    )
+
+def _compact_trace(trace: dict, max_points: int, density_points: int, multi_scatter: bool = False):
+    """
+    Returns (trace, note); note is None when the trace was left as is.
+    With `multi_scatter` (several marker scatters, e.g. one per colour) huge
+    scatters are subsampled rather than binned, since one opaque heatmap per
+    trace would hide all but the top one.
+    """
+    kind = trace.get("type", "scatter")
+    points = _points(trace)
+    name = f" '{trace['name']}'" if trace.get("name") else ""
+    if kind in ("scatter", "scattergl") and trace.get("y") is not None and points > max_points:
+        mode = trace.get("mode") or "lines"
+        if "lines" in mode:
+            return _downsample_line(trace, max_points), f"line{name} downsampled from {points:,} to {max_points:,} points (LTTB)"
+        if multi_scatter and points > density_points:
+            trace = _subsample(trace, max_points)
+            if kind == "scatter" and max_points > SCATTER_WEBGL_POINTS:
+                trace["type"] = "scattergl"
+            return trace, f"scatter{name} subsampled from {points:,} to {max_points:,} points"
+        density = _density(trace) if points > density_points and not multi_scatter else None
+        if density is not None:
+            return density, f"scatter{name} of {points:,} points drawn as a density heatmap"
+        if kind == "scatter" and points > SCATTER_WEBGL_POINTS:
+            return {**trace, "type": "scattergl"}, f"scatter{name} of {points:,} points drawn with WebGL"
+    if kind == "histogram" and points > density_points and trace.get("x") is not None:
+        binned = _prebin_histogram(trace)
+        if binned is not None:
+            return binned, f"histogram{name} of {points:,} values binned on the server"
+    return trace, None
+
+def compact_figure(fig, max_points: int = FIGURE_MAX_POINTS, max_bytes: int = FIGURE_MAX_BYTES):
+    """
+    Makes a Plotly figure cheap to send to the browser and to keep in history:
+    long lines are downsampled with LTTB, large scatters switch to WebGL or a
+    density heatmap (several scatters, e.g. one per colour, are subsampled
+    instead), large histograms are binned here, and while the serialized
+    figure is over `max_bytes` the point limit is halved and WebGL scatters
+    are binned or subsampled too.
+    Returns (figure, notes); `fig` itself is never modified and is returned
+    unchanged when nothing had to be done.
+    """
+    if not isinstance(fig, go.Figure):
+        return fig, []
+    traces = [trace.to_plotly_json() for trace in fig.data]
+    original_size = len(fig.to_json())
+    if original_size <= max_bytes and not any(
+        _points(trace) > min(max_points, SCATTER_WEBGL_POINTS) for trace in traces
+    ):
+        return fig, []
+    multi_scatter = sum(1 for trace in traces if _is_marker_scatter(trace)) > 1
+
+    density_points = BINNING_MIN_POINTS
+    while True:
+        compacted, notes = [], []
+        for trace in traces:
+            trace, note = _compact_trace(trace, max_points, density_points, multi_scatter)
+            compacted.append(trace)
+            if note:
+                notes.append(note)
+        result = go.Figure(data=compacted, layout=fig.layout) if notes else fig
+        size = len(result.to_json()) if notes else original_size
+        if size <= max_bytes:
+            return result, notes
+        if max_points <= MIN_POINTS:
+            notes.append(f"figure is still {size / 1024 / 1024:.1f} MB; aggregate the data before plotting")
+            return result, notes
+        if notes or density_points == SCATTER_WEBGL_POINTS:
+            max_points = max(MIN_POINTS, max_points // 2)
+        # Bin or subsample WebGL scatters too
+        density_points = SCATTER_WEBGL_POINTS
+
+@lru_cache(maxsize=64)
+def figure_from_json(fig_json: str) -> go.Figure:
+    """Rebuilds a figure stored as JSON in the chat history, once per figure."""
+    return pio.from_json(fig_json)
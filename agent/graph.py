@@ -1,53 +1,202 @@
+import asyncio
+import contextvars
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Annotated, Literal
 
 from langchain_groq import ChatGroq
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
 
+from agent.history import HISTORY_TOKEN_BUDGET, compact_history, estimate_tokens
 from agent.state import AgentState
 from agent.tools import get_tools
 from agent.prompts import SYSTEM_PROMPT
+from utils.db import format_schema_catalog, get_schema_catalog
+from utils.profile import describe_dataframes
+from utils.tracing import span
 
-def get_agent_graph(api_key: str, dataframes: dict, shared_state: dict):
-    """Builds and returns the LangGraph agent."""
-    
-    if not api_key:
-        raise ValueError("Groq API Key is required.")
+# The prompt never changes between turns, so build it once at import time.
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    MessagesPlaceholder(variable_name="messages"),
+])
+
+# Tool calls from a single LLM turn that are executed at the same time.
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("AUTOANALYTX_MAX_PARALLEL_TOOLS", "4"))
+
+def _tool_error(tool_call, e) -> ToolMessage:
+    return ToolMessage(
+        content=f"Error: {e}",
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"],
+        status="error",
+    )
+
+def run_tool_calls(tools_by_name: dict, tool_calls: list, config) -> list:
+    """
+    Executes the tool calls of one AIMessage concurrently on a thread pool.
+    execute_python calls still run one at a time, as they share the session's kernel.
+    Returns the ToolMessages in the order of `tool_calls`. Each message carries
+    its own run time in ``response_metadata["duration_s"]`` and the wall time of
+    the whole batch in ``response_metadata["batch_duration_s"]``.
+    """
+
+    def run_one(tool_call):
+        start = time.perf_counter()
+        tool = tools_by_name.get(tool_call["name"])
+        try:
+            if tool is None:
+                raise ValueError(f"Unknown tool: {tool_call['name']}")
+            message = tool.invoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _tool_error(tool_call, e)
+        message.response_metadata["duration_s"] = time.perf_counter() - start
+        return message
+
+    start = time.perf_counter()
+    if len(tool_calls) == 1:
+        messages = [run_one(tool_calls[0])]
+    else:
+        workers = min(len(tool_calls), MAX_PARALLEL_TOOL_CALLS)
+        # Each call runs in a copy of this context, so its spans join the current trace
+        contexts = [contextvars.copy_context() for _ in tool_calls]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="autoanalytx-tool") as executor:
+            # map() yields results in submission order
+            messages = list(executor.map(lambda context, call: context.run(run_one, call), contexts, tool_calls))
+    batch_duration = time.perf_counter() - start
+    for message in messages:
+        message.response_metadata["batch_duration_s"] = batch_duration
+    return messages
 
-    llm = ChatGroq(
+async def arun_tool_calls(tools_by_name: dict, tool_calls: list, config) -> list:
+    """
+    Async counterpart of `run_tool_calls`. The tools are synchronous (pandas,
+    the kernel, database drivers), so `ainvoke` runs each one on an executor
+    thread; at most MAX_PARALLEL_TOOL_CALLS of a batch run at the same time.
+    """
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_TOOL_CALLS)
+
+    async def run_one(tool_call):
+        start = time.perf_counter()
+        tool = tools_by_name.get(tool_call["name"])
+        try:
+            if tool is None:
+                raise ValueError(f"Unknown tool: {tool_call['name']}")
+            async with semaphore:
+                message = await tool.ainvoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            message = _tool_error(tool_call, e)
+        message.response_metadata["duration_s"] = time.perf_counter() - start
+        return message
+
+    start = time.perf_counter()
+    # gather() returns results in submission order
+    messages = await asyncio.gather(*(run_one(tool_call) for tool_call in tool_calls))
+    batch_duration = time.perf_counter() - start
+    for message in messages:
+        message.response_metadata["batch_duration_s"] = batch_duration
+    return list(messages)
+
+@lru_cache(maxsize=8)
+def get_llm(api_key: str):
+    """Returns a ChatGroq client, cached per API key so HTTP connections are reused."""
+    return ChatGroq(
         model="llama-3.3-70b-versatile",
         api_key=api_key,
         temperature=0,
         streaming=True
     )
 
-    # Get tools with injected context
-    tools = get_tools(dataframes, shared_state)
+@lru_cache(maxsize=8)
+def get_agent_graph(api_key: str):
+    """Builds and returns the LangGraph agent.
+
+    The compiled graph is cached per API key and reused across chat turns.
+    Its nodes have sync and async implementations, so the same graph serves
+    ``invoke``/``stream`` and ``ainvoke``/``astream`` (see `arun`).
+    Dataframes and shared state are not part of the graph; pass them per run
+    through ``config["configurable"]`` (see ``agent.tools.get_tools``).
+    """
+
+    if not api_key:
+        raise ValueError("Groq API Key is required.")
+
+    return build_agent_graph(get_llm(api_key))
+
+def _iteration(messages) -> int:
+    """Returns the ReAct iteration the next LLM call is in: 1 plus the AI messages since the question."""
+    iteration = 1
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        iteration += isinstance(message, AIMessage)
+    return iteration
+
+def _record_usage(llm_span, response, inputs):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        llm_span.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+    else:
+        # Streaming responses may come without usage; fall back to the history estimate
+        llm_span.set(
+            input_tokens=estimate_tokens(inputs["messages"]),
+            output_tokens=estimate_tokens([response]),
+            tokens_estimated=True,
+        )
+    llm_span.set(tool_calls=len(response.tool_calls))
+
+def build_agent_graph(llm):
+    """Compiles the agent graph around any tool-calling chat model (uncached)."""
+
+    # Tools read their per-run context from the RunnableConfig
+    tools = get_tools()
+    tools_by_name = {t.name: t for t in tools}
 
     # Bind tools to the LLM
     llm_with_tools = llm.bind_tools(tools)
+    chain = PROMPT | llm_with_tools
 
-    def agent_node(state: AgentState):
-        messages = state['messages']
-        # We can inject data context into the system prompt or as a message here if needed
-        # For now, we rely on the tools having access to the data in the REPL
-        
-        # Add system prompt if it's the first message or ensure it's there
-        # Actually, let's just prepend the system prompt to the messages list for the LLM call
-        # or use a ChatPromptTemplate.
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", SYSTEM_PROMPT),
-            MessagesPlaceholder(variable_name="messages"),
-        ])
-        
-        chain = prompt | llm_with_tools
-        response = chain.invoke({"messages": messages})
+    def agent_inputs(state: AgentState, configurable: dict, data_profile: str) -> dict:
+        # Older turns are summarized so the prompt stays within the token budget
+        messages = compact_history(
+            state['messages'],
+            configurable.get("history_tokens") or HISTORY_TOKEN_BUDGET,
+        )
+        return {"messages": messages, "data_profile": data_profile}
+
+    def agent_node(state: AgentState, config: RunnableConfig):
+        configurable = config.get("configurable", {})
+        # Profiles are cached per data fingerprint, so this is cheap after the first call
+        inputs = agent_inputs(state, configurable, describe_context(configurable))
+        with span("agent_node", iteration=_iteration(state['messages'])) as llm_span:
+            # Passing the config lets stream_mode="messages" pick up the LLM tokens
+            response = chain.invoke(inputs, config)
+            _record_usage(llm_span, response, inputs)
         return {"messages": [response]}
 
+    async def aagent_node(state: AgentState, config: RunnableConfig):
+        configurable = config.get("configurable", {})
+        # May reflect the database schema on a cache miss, so keep it off the event loop
+        data_profile = await asyncio.to_thread(describe_context, configurable)
+        inputs = agent_inputs(state, configurable, data_profile)
+        with span("agent_node", iteration=_iteration(state['messages'])) as llm_span:
+            response = await chain.ainvoke(inputs, config)
+            _record_usage(llm_span, response, inputs)
+        return {"messages": [response]}
+
+    def tool_node(state: AgentState, config: RunnableConfig):
+        tool_calls = state['messages'][-1].tool_calls
+        return {"messages": run_tool_calls(tools_by_name, tool_calls, config)}
+
+    async def atool_node(state: AgentState, config: RunnableConfig):
+        tool_calls = state['messages'][-1].tool_calls
+        return {"messages": await arun_tool_calls(tools_by_name, tool_calls, config)}
+
     def should_continue(state: AgentState) -> Literal["tools", "__end__"]:
         messages = state['messages']
         last_message = messages[-1]
@@ -57,8 +206,8 @@ def get_agent_graph(api_key: str, dataframes: dict, shared_state: dict):
 
     workflow = StateGraph(AgentState)
 
-    workflow.add_node("agent", agent_node)
-    workflow.add_node("tools", ToolNode(tools))
+    workflow.add_node("agent", RunnableLambda(agent_node, afunc=aagent_node, name="agent"))
+    workflow.add_node("tools", RunnableLambda(tool_node, afunc=atool_node, name="tools"))
 
     workflow.set_entry_point("agent")
 
@@ -70,3 +219,41 @@ def get_agent_graph(api_key: str, dataframes: dict, shared_state: dict):
     workflow.add_edge("tools", "agent")
 
     return workflow.compile()
+
+def get_run_config(dataframes: dict, shared_state: dict, kernel=None, db_engine=None, output_store=None) -> dict:
+    """Builds the per-run config carrying the session context for the tools."""
+    return {
+        "configurable": {
+            "dataframes": dataframes,
+            "shared_state": shared_state,
+            "kernel": kernel,
+            "db_engine": db_engine,
+            "output_store": output_store,
+        }
+    }
+
+async def arun(api_key: str, messages: list, config: dict) -> list:
+    """
+    Runs one chat turn without blocking the event loop and returns the new
+    messages. LLM calls are awaited and tools run on executor threads, so one
+    process can drive many conversations concurrently.
+    """
+    graph = get_agent_graph(api_key)
+    state = await graph.ainvoke({"messages": messages}, config)
+    return state["messages"][len(messages):]
+
+def describe_context(configurable: dict) -> str:
+    """Renders the loaded data and connected database for the system prompt."""
+    description = describe_dataframes(configurable.get("dataframes") or {})
+    engine = configurable.get("db_engine")
+    if engine is not None:
+        description += (
+            f"\n\nA {engine.dialect.name} database is connected. Dataframes loaded from it are "
+            "samples; use the `run_sql` tool to aggregate full tables in the database."
+        )
+        try:
+            # TTL-cached, shared with the sidebar
+            description += "\nTables:\n" + format_schema_catalog(get_schema_catalog(engine))
+        except Exception:
+            pass  # The agent can still list tables with run_sql
+    return description
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+# Approximate token budget for the conversation sent to the LLM on each call.
+HISTORY_TOKEN_BUDGET = int(os.getenv("AUTOANALYTX_HISTORY_TOKENS", "6000"))
+# Most recent turns (user question onwards) that are always kept verbatim.
+KEEP_RECENT_TURNS = int(os.getenv("AUTOANALYTX_KEEP_RECENT_TURNS", "2"))
+CHARS_PER_TOKEN = 4
+# Characters kept from tool outputs of earlier turns and from summarized turns.
+COMPACT_TOOL_OUTPUT_CHARS = 300
+SUMMARY_QUESTION_CHARS = 300
+SUMMARY_ANSWER_CHARS = 600
+SUMMARY_CACHE_SIZE = 1024
+
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+
+def _text(message) -> str:
+    content = message.content
+    return content if isinstance(content, str) else str(content)
+
+def estimate_tokens(messages) -> int:
+    """Roughly estimates the prompt tokens of `messages` (4 characters per token)."""
+    chars = 0
+    for message in messages:
+        chars += len(_text(message))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            chars += len(str(tool_call.get("args", "")))
+    return chars // CHARS_PER_TOKEN
+
+def split_turns(messages) -> list:
+    """Splits a conversation into turns, each starting with a user message."""
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + f" ... [{len(text) - limit} chars omitted]"
+
+def _turn_key(turn) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for message in turn:
+        digest.update(message.type.encode())
+        digest.update(_text(message).encode())
+        digest.update(repr(getattr(message, "tool_calls", None)).encode())
+    return digest.hexdigest()
+
+def summarize_turn(turn) -> str:
+    """Condenses one turn to its question and final answer. Cached per turn content."""
+    key = _turn_key(turn)
+    with _summaries_lock:
+        if key in _summaries:
+            _summaries.move_to_end(key)
+            return _summaries[key]
+
+    question = next((_text(m) for m in turn if isinstance(m, HumanMessage)), "")
+    answer = next(
+        (_text(m) for m in reversed(turn) if isinstance(m, AIMessage) and m.content and not m.tool_calls),
+        "",
+    )
+    tool_runs = sum(isinstance(m, ToolMessage) for m in turn)
+    summary = f"Q: {_truncate(question, SUMMARY_QUESTION_CHARS)}"
+    if answer:
+        summary += f"\nA: {_truncate(answer, SUMMARY_ANSWER_CHARS)}"
+    if tool_runs:
+        summary += f"\n({tool_runs} tool calls; variables created then may still exist in the session)"
+
+    with _summaries_lock:
+        _summaries[key] = summary
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
+
+def _compact_tool_outputs(turn) -> list:
+    compacted = []
+    for message in turn:
+        if isinstance(message, ToolMessage) and len(_text(message)) > COMPACT_TOOL_OUTPUT_CHARS:
+            message = message.model_copy(update={"content": _truncate(_text(message), COMPACT_TOOL_OUTPUT_CHARS)})
+        compacted.append(message)
+    return compacted
+
+def compact_history(messages, budget: int = HISTORY_TOKEN_BUDGET, keep_turns: int = KEEP_RECENT_TURNS) -> list:
+    """
+    Fits the conversation into roughly `budget` tokens before an LLM call.
+    The last `keep_turns` turns stay verbatim, except that tool outputs of
+    turns other than the current one are shortened. Older turns are replaced
+    by cached question/answer summaries, newest first, in a system message;
+    summaries that still don't fit are dropped. Tool calls and their outputs
+    are always kept or dropped together, so the message sequence stays valid.
+    """
+    if estimate_tokens(messages) <= budget:
+        return messages
+
+    turns = split_turns(messages)
+    keep_turns = max(1, keep_turns)
+    older, recent = turns[:-keep_turns], turns[-keep_turns:]
+    recent = [_compact_tool_outputs(turn) for turn in recent[:-1]] + [recent[-1]]
+    kept = [message for turn in recent for message in turn]
+
+    remaining = budget - estimate_tokens(kept)
+    summaries = []
+    for turn in reversed(older):
+        summary = summarize_turn(turn)
+        cost = len(summary) // CHARS_PER_TOKEN
+        if cost > remaining:
+            break
+        summaries.append(summary)
+        remaining -= cost
+
+    if not summaries:
+        return kept
+    summary_message = SystemMessage(
+        content="Summary of the earlier conversation (oldest first):\n\n" + "\n\n".join(reversed(summaries))
+    )
+    return [summary_message] + kept
@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+import threading
+from io import StringIO
+import contextlib
+import contextvars
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from agent.figures import compact_figure
+
+# Memory budget for the variables the agent creates in a session, in MB.
+DEFAULT_MEMORY_BUDGET_MB = int(os.getenv("AUTOANALYTX_KERNEL_MEMORY_MB", "512"))
+
+# Frames larger than this are sized without inspecting every Python object.
+DEEP_SIZE_MAX_ROWS = 100_000
+
+# Printed DataFrames go back into the LLM prompt, so keep their repr compact.
+DISPLAY_OPTIONS = {
+    "display.max_rows": 20,
+    "display.min_rows": 10,
+    "display.max_columns": 20,
+    "display.width": 200,
+    "display.max_colwidth": 50,
+}
+for _option, _value in DISPLAY_OPTIONS.items():
+    pd.set_option(_option, _value)
+
+# Capture buffer of the execution running in the current thread / task.
+_stdout_capture = contextvars.ContextVar("stdout_capture", default=None)
+_install_lock = threading.Lock()
+
+class _StdoutRouter:
+    """
+    Process-wide `sys.stdout` replacement that writes to the capture buffer of
+    the current context, or to the original stream when nothing is captured.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        buffer = _stdout_capture.get()
+        return self._stream if buffer is None else buffer
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def writelines(self, lines):
+        return self._target().writelines(lines)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def _install_stdout_router():
+    with _install_lock:
+        if not isinstance(sys.stdout, _StdoutRouter):
+            sys.stdout = _StdoutRouter(sys.stdout)
+
+@contextlib.contextmanager
+def stdoutIO(stdout=None):
+    """
+    Captures `print` output of the current thread or asyncio task only.
+    `sys.stdout` is swapped once for a router and never restored, so concurrent
+    captures cannot steal each other's output or restore the wrong stream.
+    """
+    if stdout is None:
+        stdout = StringIO()
+    _install_stdout_router()
+    token = _stdout_capture.set(stdout)
+    try:
+        yield stdout
+    finally:
+        _stdout_capture.reset(token)
+
+def sizeof(obj) -> int:
+    """Estimates the memory held by a namespace value, in bytes."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=len(obj) <= DEEP_SIZE_MAX_ROWS).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=len(obj) <= DEEP_SIZE_MAX_ROWS))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    try:
+        return sys.getsizeof(obj)
+    except TypeError:
+        return 0
+
+class PythonKernel:
+    """
+    A persistent Python namespace for one chat session.
+    Variables created by one `execute_python` call (intermediate frames,
+    fitted models, ...) stay available to the following calls until the
+    kernel is reset or they are evicted to respect the memory budget.
+    """
+
+    def __init__(self, dataframes: dict = None, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.dataframes = {}
+        self._lock = threading.RLock()
+        self.reset(dataframes)
+
+    def reset(self, dataframes: dict = None):
+        """Clears every variable created by the agent and reinjects the dataframes."""
+        with self._lock:
+            if dataframes is not None:
+                self.dataframes = dict(dataframes)
+            self.namespace = {
+                "pd": pd,
+                "px": px,
+                "go": go,
+            }
+            # Shallow copies: the loaded frames are shared through the dataset
+            # cache, so agent code must not modify them in place
+            self.namespace.update({
+                name: df.copy(deep=False) if isinstance(df, pd.DataFrame) else df
+                for name, df in self.dataframes.items()
+            })
+            self._base_names = set(self.namespace)
+
+    def load(self, dataframes: dict):
+        """Resets the kernel if `dataframes` differ from the ones already loaded."""
+        with self._lock:
+            same = (
+                dataframes.keys() == self.dataframes.keys()
+                and all(self.dataframes[k] is v for k, v in dataframes.items())
+            )
+            if not same:
+                self.reset(dataframes)
+
+    def user_variables(self) -> dict:
+        """Returns the variables created by the agent, with their estimated size."""
+        with self._lock:
+            return {
+                name: sizeof(value)
+                for name, value in self.namespace.items()
+                if name not in self._base_names and not name.startswith("__")
+            }
+
+    def enforce_memory_budget(self) -> list:
+        """Drops the largest agent variables until the namespace fits the budget."""
+        with self._lock:
+            sizes = self.user_variables()
+            total = sum(sizes.values())
+            evicted = []
+            for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+                if total <= self.memory_budget:
+                    break
+                del self.namespace[name]
+                total -= size
+                evicted.append(name)
+            return evicted
+
+    def run(self, code: str):
+        """
+        Executes `code` in the persistent namespace.
+        Returns (output, fig, evicted) where `fig` is the Plotly figure the code
+        assigned or updated (or None) and `evicted` lists the variables dropped
+        to stay within the memory budget. Exceptions raised by the code propagate.
+
+        Calls on one kernel are serialized: functions defined by the agent keep
+        the namespace as their globals, so each call must see the bindings of
+        the previous ones. Separate sessions (and sandbox workers) still run
+        in parallel.
+        """
+        with self._lock:
+            previous_fig = self.namespace.get("fig")
+            with stdoutIO() as s:
+                exec(code, self.namespace)
+            output = s.getvalue()
+            fig = self.namespace.get("fig")
+
+        if fig is previous_fig and not re.search(r"\bfig\b", code):
+            fig = None
+        if fig is not None:
+            # A downsampled copy: the agent's own `fig` keeps every point
+            fig, notes = compact_figure(fig)
+            if notes:
+                output += f"\n[Figure: {'; '.join(notes)}]\n"
+
+        evicted = self.enforce_memory_budget()
+        return output, fig, evicted
@@ -0,0 +1,106 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+# Characters of tool output that go back into the LLM prompt.
+MAX_TOOL_OUTPUT_CHARS = int(os.getenv("AUTOANALYTX_MAX_TOOL_OUTPUT_CHARS", "4000"))
+# Share of the budget given to the head of a truncated output; the tail gets the rest.
+HEAD_SHARE = 0.6
+# Characters per page when reading a stored output back.
+PAGE_CHARS = MAX_TOOL_OUTPUT_CHARS
+# Full outputs kept per store, oldest evicted first.
+STORE_MAX_ENTRIES = 50
+
+class OutputStore:
+    """Keeps the full text of truncated tool outputs so they can be paged through."""
+
+    def __init__(self, max_entries: int = STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._outputs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put(self, text: str) -> str:
+        with self._lock:
+            output_id = f"out-{next(self._ids)}"
+            self._outputs[output_id] = text
+            while len(self._outputs) > self.max_entries:
+                self._outputs.popitem(last=False)
+            return output_id
+
+    def get(self, output_id: str):
+        with self._lock:
+            return self._outputs.get(output_id)
+
+    def ids(self) -> list:
+        with self._lock:
+            return list(self._outputs)
+
+    def page(self, output_id: str, page: int = 1, page_chars: int = PAGE_CHARS):
+        """
+        Returns (text, page_count) for a 1-based page, or (None, 0) if the id
+        is unknown. Pages hold whole lines up to `page_chars` characters; longer
+        lines are cut.
+        """
+        text = self.get(output_id)
+        if text is None:
+            return None, 0
+        pages = [[]]
+        size = 0
+        for line in text.splitlines():
+            line = line[:page_chars]
+            if pages[-1] and size + len(line) + 1 > page_chars:
+                pages.append([])
+                size = 0
+            pages[-1].append(line)
+            size += len(line) + 1
+        page = min(max(1, page), len(pages))
+        return "\n".join(pages[page - 1]), len(pages)
+
+# Fallback for runs that don't pass a session store in their config.
+default_store = OutputStore()
+
+def collapse_repeats(text: str) -> str:
+    """Replaces runs of identical consecutive lines with one line and a count."""
+    collapsed = []
+    for line, group in itertools.groupby(text.splitlines()):
+        count = sum(1 for _ in group)
+        collapsed.append(line)
+        if count > 2:
+            collapsed.append(f"[previous line repeated {count - 1} more times]")
+        elif count == 2:
+            collapsed.append(line)
+    return "\n".join(collapsed)
+
+def compact_output(text: str, store: OutputStore, max_chars: int = MAX_TOOL_OUTPUT_CHARS):
+    """
+    Bounds a tool output before it re-enters the LLM loop.
+    Repeated lines are collapsed; if the text is still over `max_chars`, its
+    head and tail are kept around a marker, and the full output is saved in
+    `store`. Returns (text, output_id), where output_id is None when nothing
+    had to be stored.
+    """
+    compacted = collapse_repeats(text)
+    if len(compacted) <= max_chars:
+        return compacted, None
+
+    output_id = store.put(text)
+    head = compacted[:int(max_chars * HEAD_SHARE)]
+    tail = compacted[-(max_chars - len(head)):]
+    # Cut at line boundaries so rows of tables stay whole
+    whole_lines = "\n" in head and "\n" in tail
+    head = head[:head.rfind("\n")] if "\n" in head else head
+    tail = tail[tail.find("\n") + 1:] if "\n" in tail else tail
+    middle = compacted[len(head):len(compacted) - len(tail)]
+    lines = middle.count("\n") - 1
+    if whole_lines and lines > 0:
+        omitted = f"{lines:,} lines"
+    else:
+        # A cut inside a long line (e.g. one huge repr) is counted in characters
+        omitted = f"{max(0, len(middle)):,} characters"
+    marker = (
+        f"\n... [{omitted} omitted. Full output saved as '{output_id}'; "
+        f"use the read_output tool to page through it] ...\n"
+    )
+    return head + marker + tail, output_id
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from agent.tools import get_tools
+from utils.db import get_schema_catalog
+from utils.profile import get_profile
+
+# Answers kept in the process-wide cache, least recently used evicted first.
+RESULT_CACHE_SIZE = int(os.getenv("AUTOANALYTX_RESULT_CACHE_SIZE", "256"))
+# Seconds a cached answer stays valid.
+RESULT_CACHE_TTL = int(os.getenv("AUTOANALYTX_RESULT_CACHE_TTL", "86400"))
+# Shorter validity for answers computed with run_sql on the live database,
+# whose tables can change without the app noticing.
+DB_RESULT_CACHE_TTL = int(os.getenv("AUTOANALYTX_RESULT_CACHE_DB_TTL", "300"))
+# Cosine similarity above which two questions count as the same question.
+SIMILARITY_THRESHOLD = float(os.getenv("AUTOANALYTX_RESULT_CACHE_SIMILARITY", "0.9"))
+# Hashed features (words and word pairs) two long questions may differ by and
+# still match; swapping a single word changes at least two.
+SIMILARITY_MAX_DIFFERENCE = 1.5
+# Re-run the cached code when the same question is asked on changed data of the same schema.
+RERUN_ON_CHANGE = os.getenv("AUTOANALYTX_RESULT_CACHE_RERUN", "0") == "1"
+EMBEDDING_DIM = 1024
+
+# Numbers (years, amounts, percentages) and quoted values must match exactly.
+_LITERAL_PATTERN = re.compile(r"\"([^\"]*)\"|(?<!\w)'([^']*)'(?!\w)|(\d+(?:[.,]\d+)*%?)")
+
+# Words that make a question refer back to the previous one.
+_FOLLOW_UP_WORDS = frozenset(
+    "it its that those these them they their same above previous instead again also".split()
+)
+_FOLLOW_UP_STARTS = ("and ", "now ", "then ", "what about", "how about", "but ")
+
+_STOPWORDS = frozenset(
+    "a an the of for to in on by with and or me my our us we i you please can could would "
+    "show give tell what which is are was were be do does did this that these those it its "
+    "from per all each some any how".split()
+)
+
+def normalize_question(question: str) -> list:
+    """Lowercases `question` and returns its content words, crudely singularized."""
+    words = re.findall(r"[a-z0-9_]+", re.sub(r"'s\b|'", "", question.lower()))
+    tokens = []
+    for word in words:
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+def question_literals(question: str) -> tuple:
+    """Returns the numbers and quoted values of `question`, which similar questions must share."""
+    literals = []
+    for quoted, single_quoted, number in _LITERAL_PATTERN.findall(question):
+        literals.append(number or quoted or single_quoted)
+    return tuple(sorted(literals))
+
+def similarity_threshold(token_count: int, base: float = SIMILARITY_THRESHOLD) -> float:
+    """
+    Returns the similarity two questions of `token_count` content words need.
+    One changed word moves the cosine of a long question less than that of a
+    short one, so the bar rises with length.
+    """
+    features = 2 * token_count - 1
+    return max(base, 1 - SIMILARITY_MAX_DIFFERENCE / features) if features > 0 else base
+
+def is_follow_up(question: str) -> bool:
+    """
+    Tells whether `question` looks like it depends on the previous one
+    ("and by region?", "plot that instead"). Only those are cached under the
+    previous question; standalone questions match regardless of what preceded them.
+    """
+    text = question.lower().strip()
+    words = re.findall(r"[a-z]+", text)
+    return text.startswith(_FOLLOW_UP_STARTS) or any(word in _FOLLOW_UP_WORDS for word in words)
+
+def _bucket(feature: str) -> tuple:
+    digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % EMBEDDING_DIM, 1.0 if value >> 63 else -1.0
+
+def embed_question(tokens: list) -> np.ndarray:
+    """
+    Embeds normalized tokens with the hashing trick (words and word pairs),
+    so similar phrasings land close together without an embedding model.
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for feature in features:
+        index, sign = _bucket(feature)
+        vector[index] += sign
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _describe_source(name, data):
+    if isinstance(data, pd.DataFrame):
+        profile = get_profile(data)
+        schema = [(str(c), str(t)) for c, t in data.dtypes.items()]
+        return profile["fingerprint"], schema
+    # Out-of-core datasets carry a profile computed when they were opened
+    profile = getattr(data, "profile", None) or {}
+    digest = hashlib.blake2b(json.dumps(profile, sort_keys=True, default=str).encode(), digest_size=16)
+    schema = [(c.get("name"), c.get("dtype")) for c in profile.get("columns", [])]
+    return digest.hexdigest(), schema
+
+def dataset_signature(dataframes: dict, db_engine=None) -> tuple:
+    """
+    Returns (fingerprint, schema) for the loaded data: the fingerprint changes
+    with the content, the schema only with table names, columns and types.
+    """
+    fingerprint = hashlib.blake2b(digest_size=16)
+    schema = hashlib.blake2b(digest_size=16)
+    for name in sorted(dataframes):
+        data_fingerprint, columns = _describe_source(name, dataframes[name])
+        fingerprint.update(f"{name}:{data_fingerprint};".encode())
+        schema.update(f"{name}:{columns};".encode())
+    if db_engine is not None:
+        url = db_engine.url.render_as_string(hide_password=True)
+        fingerprint.update(url.encode())
+        schema.update(url.encode())
+        try:
+            # Cached catalog: row estimates change the fingerprint when tables grow or shrink
+            catalog = get_schema_catalog(db_engine)
+        except Exception:
+            catalog = {}
+        for table in sorted(catalog):
+            fingerprint.update(f"{table}:{catalog[table].get('rows')};".encode())
+            schema.update(f"{table}:{catalog[table].get('columns')};".encode())
+    return fingerprint.hexdigest(), schema.hexdigest()
+
+def extract_steps(messages) -> list:
+    """Returns the (tool name, args) of every tool call made in `messages`."""
+    return [
+        (tool_call["name"], tool_call["args"])
+        for message in messages
+        for tool_call in getattr(message, "tool_calls", None) or []
+    ]
+
+class ResultCache:
+    """
+    Caches final answers per dataset and question so repeated questions skip
+    the agent loop. Questions match exactly after normalization or by cosine
+    similarity of their hashed embeddings, above a threshold that rises with
+    question length; either way their numbers and quoted values must be the
+    same. `context` (the previous question, passed only for follow-ups, see
+    `is_follow_up`) is part of the key, so follow-ups are only reused in the
+    same context. Answers that queried the live database with run_sql expire
+    after DB_RESULT_CACHE_TTL.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: int = RESULT_CACHE_TTL,
+                 threshold: float = SIMILARITY_THRESHOLD, db_ttl: int = DB_RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_ttl = db_ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _key(fingerprint, context, tokens):
+        return fingerprint, " ".join(normalize_question(context)), " ".join(tokens)
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry["expires"] <= now]:
+            del self._entries[key]
+
+    def _best_match(self, accept, vector, literals, token_count):
+        best, best_score = None, 0.0
+        for key, entry in self._entries.items():
+            if entry["literals"] != literals or not accept(key, entry):
+                continue
+            score = float(np.dot(vector, entry["vector"]))
+            threshold = similarity_threshold(max(token_count, entry["tokens"]), self.threshold)
+            if score >= threshold and score > best_score:
+                best, best_score = key, score
+        return best
+
+    def lookup(self, fingerprint: str, schema: str, question: str, context: str = "", rerun: bool = RERUN_ON_CHANGE):
+        """
+        Returns the cached entry for `question`, or None. The entry has
+        "stale": True when the same question (after normalization, not just a
+        similar one) was answered on different data of the same schema; its
+        steps should then be re-run rather than its answer replayed.
+        """
+        tokens = normalize_question(question)
+        if not tokens:
+            return None
+        exact_key = self._key(fingerprint, context, tokens)
+        literals = question_literals(question)
+        vector = embed_question(tokens)
+        with self._lock:
+            self._expire()
+            if exact_key in self._entries and self._entries[exact_key]["literals"] == literals:
+                key = exact_key
+            else:
+                key = self._best_match(lambda k, e: k[:2] == exact_key[:2], vector, literals, len(tokens))
+            stale = False
+            if key is None and rerun:
+                # Answers computed on other data can only be reproduced by their tool calls
+                key = next((
+                    k for k, e in self._entries.items()
+                    if k[1:] == exact_key[1:] and e["schema"] == schema and e["literals"] == literals and e["steps"]
+                ), None)
+                stale = key is not None
+            if key is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["stale_hits" if stale else "hits"] += 1
+            return {**self._entries[key], "stale": stale}
+
+    def store(self, fingerprint: str, schema: str, question: str, answer: str,
+              steps: list = None, figures: list = None, context: str = ""):
+        """Caches a final answer with the tool calls that produced it and the figures as JSON."""
+        tokens = normalize_question(question)
+        if not tokens or not answer:
+            return
+        steps = steps or []
+        ttl = self.ttl
+        if any(name == "run_sql" for name, _ in steps):
+            ttl = min(ttl, self.db_ttl)
+        with self._lock:
+            self._entries[self._key(fingerprint, context, tokens)] = {
+                "question": question,
+                "answer": answer,
+                "steps": steps,
+                "figures": figures or [],
+                "schema": schema,
+                "literals": question_literals(question),
+                "tokens": len(tokens),
+                "vector": embed_question(tokens),
+                "created": time.time(),
+                "expires": time.monotonic() + ttl,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    """Returns the process-wide result cache, shared by every session."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+def rerun_steps(steps: list, config) -> list:
+    """
+    Re-runs cached tool calls against the current data with the session's
+    tools and config. Returns the tool outputs; figures land in the shared
+    state as with a normal run.
+    """
+    tools_by_name = {t.name: t for t in get_tools()}
+    outputs = []
+    for name, args in steps:
+        if name == "read_output" or name not in tools_by_name:
+            continue
+        outputs.append(tools_by_name[name].invoke(args, config))
+    return outputs
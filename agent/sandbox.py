@@ -0,0 +1,338 @@
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import plotly.io as pio
+import psutil
+
+from agent.kernel import sizeof
+from utils.tracing import annotate
+
+# Number of worker processes; 0 disables the sandbox and runs code in-process.
+DEFAULT_WORKERS = int(os.getenv("AUTOANALYTX_SANDBOX_WORKERS", "2"))
+# Wall-clock limit for one execute_python call, in seconds.
+DEFAULT_TIMEOUT = float(os.getenv("AUTOANALYTX_SANDBOX_TIMEOUT", "60"))
+# Resident memory limit for one worker process, in MB.
+DEFAULT_MAX_RSS_MB = int(os.getenv("AUTOANALYTX_SANDBOX_MAX_RSS_MB", "2048"))
+# Sessions whose data a single worker keeps loaded before dropping the oldest.
+MAX_SESSIONS_PER_WORKER = 8
+# Share of the RSS cap the loaded session data of one worker may take; the
+# least recently used sessions are dropped beyond it, before any call runs.
+SESSION_DATA_SHARE = 0.5
+# Calls a single worker runs at the same time, for different sessions (a session's calls run one at a time).
+MAX_THREADS_PER_WORKER = 4
+# Loading a session's dataframes can take longer than running code on them.
+LOAD_TIMEOUT = 300
+POLL_INTERVAL = 0.1
+
+class SandboxError(Exception):
+    """Raised when sandboxed code fails or the worker running it had to be killed."""
+
+def _worker_main(conn, max_threads):
+    """Entry point of a worker process: serves requests until told to stop."""
+    # Warm up the heavy imports once so that calls don't pay for them
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import plotly.express  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    import sklearn.cluster  # noqa: F401
+    import sklearn.linear_model  # noqa: F401
+    import sklearn.model_selection  # noqa: F401
+    from agent.kernel import PythonKernel
+
+    process = psutil.Process()
+    kernels = {}
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=max_threads)
+
+    def handle(request_id, op, session_id, payload):
+        # Lets the caller start its time limit now rather than while the call was queued
+        with send_lock:
+            conn.send((request_id, "started", process.memory_info().rss))
+        try:
+            if op == "load":
+                kernels[session_id] = PythonKernel(payload)
+                result = None
+            elif op == "drop":
+                kernels.pop(session_id, None)
+                result = None
+            elif op == "run":
+                # Measured here: the caller only sees the time it spent waiting
+                rss_start = process.memory_info().rss
+                cpu_start = time.thread_time()
+                output, fig, evicted = kernels[session_id].run(payload)
+                cpu_ms = (time.thread_time() - cpu_start) * 1000
+                rss_end = process.memory_info().rss
+                usage = {
+                    "worker_cpu_ms": cpu_ms,
+                    "worker_rss_mb": rss_end / 1024 / 1024,
+                    "worker_rss_delta_mb": (rss_end - rss_start) / 1024 / 1024,
+                }
+                fig_json = fig.to_json() if hasattr(fig, "to_json") else None
+                result = (output, fig_json, evicted, usage)
+            else:
+                raise ValueError(f"Unknown sandbox operation: {op}")
+            reply = (request_id, "ok", result)
+        except Exception as e:
+            reply = (request_id, "error", str(e))
+        with send_lock:
+            conn.send(reply)
+
+    while True:
+        try:
+            request_id, op, session_id, payload = conn.recv()
+        except EOFError:
+            break
+
+        if op == "stop":
+            break
+        if op == "run":
+            # Code runs on threads so that calls of the sessions sharing this worker overlap
+            executor.submit(handle, request_id, op, session_id, payload)
+        else:
+            handle(request_id, op, session_id, payload)
+
+class SandboxWorker:
+    """
+    A pre-started worker process and the sessions whose data it holds.
+    Requests are tagged with an id so several can be in flight at once; a
+    reader thread hands each reply to the caller waiting for it, and records
+    when the worker started each request and its RSS at that moment.
+    """
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self.lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self.generation = 0
+        self._start()
+
+    def _start(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(
+            target=_worker_main, args=(child_conn, MAX_THREADS_PER_WORKER), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self._send_lock = threading.Lock()
+        # request id -> Future waiting for the reply
+        self.pending = {}
+        # request id -> (monotonic time, worker RSS) when the worker started it
+        self.started = {}
+        # session_id -> (dataframes loaded in the worker, their size in bytes), oldest first
+        self.sessions = OrderedDict()
+        threading.Thread(
+            target=self._read_replies, args=(parent_conn, self.pending, self.started), daemon=True
+        ).start()
+
+    @property
+    def loaded_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self.sessions.values())
+
+    @staticmethod
+    def _read_replies(conn, pending, started):
+        while True:
+            try:
+                request_id, status, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            if status == "started":
+                started[request_id] = (time.monotonic(), result)
+                continue
+            started.pop(request_id, None)
+            future = pending.pop(request_id, None)
+            if future is not None:
+                future.set_result((status, result))
+        # The process is gone: whoever is still waiting gets an error
+        for future in list(pending.values()):
+            if not future.done():
+                future.set_result(("error", "The sandbox worker was restarted; session variables were cleared."))
+        pending.clear()
+
+    def restart(self, generation=None):
+        """Kills the worker process and starts a fresh one; loaded sessions are lost."""
+        with self._state_lock:
+            if generation is not None and generation != self.generation:
+                return  # Another caller already restarted this worker
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+            self.conn.close()
+            self.generation += 1
+            self._start()
+
+    def stop(self):
+        try:
+            self.conn.send((None, "stop", None, None))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+
+    def rss(self) -> int:
+        """Returns the resident memory of the worker process, in bytes."""
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def request(self, op, session_id, payload, timeout, max_rss):
+        """
+        Sends one request and waits for the reply, enforcing the time and memory
+        limits. The time limit runs from when the worker starts the request, not
+        while it waits for a free thread. The worker is killed for memory only
+        when this request took it over `max_rss` (or past twice the cap), so a
+        worker already over the cap because of another call doesn't take this
+        one down with it.
+        """
+        with self._state_lock:
+            generation = self.generation
+            conn, pending, started, process = self.conn, self.pending, self.started, self.process
+        request_id = next(self._request_ids)
+        future = Future()
+        pending[request_id] = future
+        try:
+            with self._send_lock:
+                conn.send((request_id, op, session_id, payload))
+        except (BrokenPipeError, OSError):
+            self.restart(generation)
+            raise SandboxError("The sandbox worker crashed; session variables were cleared.")
+
+        while True:
+            try:
+                status, result = future.result(timeout=POLL_INTERVAL)
+                break
+            except FutureTimeoutError:
+                pass
+            if not process.is_alive():
+                self.restart(generation)
+                raise SandboxError("The sandbox worker crashed; session variables were cleared.")
+            start = started.get(request_id)
+            if start is None:
+                continue  # Still queued behind other calls in the worker
+            start_time, start_rss = start
+            if time.monotonic() > start_time + timeout:
+                self.restart(generation)
+                raise SandboxError(
+                    f"Execution exceeded the {timeout:g}s time limit; "
+                    "the sandbox was restarted and session variables were cleared."
+                )
+            rss = self.rss() if max_rss else 0
+            if max_rss and rss > max_rss and (start_rss <= max_rss or rss > 2 * max_rss):
+                self.restart(generation)
+                raise SandboxError(
+                    f"Execution exceeded the {max_rss // (1024 * 1024)}MB memory limit; "
+                    "the sandbox was restarted and session variables were cleared."
+                )
+
+        if status == "error":
+            raise SandboxError(result)
+        return result
+
+class SandboxPool:
+    """
+    A pool of pre-started worker processes that run agent code out of process.
+    Each session is pinned to the worker holding the least data when it
+    starts, and that worker keeps the session's dataframes and persistent
+    namespace loaded; idle sessions are dropped once the loaded data exceeds
+    SESSION_DATA_SHARE of the RSS cap. Calls of different sessions run in
+    parallel, across workers and on worker threads; a call that exceeds the
+    wall-clock timeout or pushes the worker over the RSS cap gets its worker
+    killed and respawned.
+    """
+
+    def __init__(self, size: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                 max_rss_mb: int = DEFAULT_MAX_RSS_MB):
+        ctx = mp.get_context("spawn")
+        self.timeout = timeout
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.workers = [SandboxWorker(ctx) for _ in range(max(1, size))]
+        self._assignments = {}
+        self._lock = threading.Lock()
+
+    def _worker_for(self, session_id) -> SandboxWorker:
+        with self._lock:
+            worker = self._assignments.get(session_id)
+            if worker is None:
+                worker = min(self.workers, key=lambda w: (w.loaded_bytes, len(w.sessions)))
+                self._assignments[session_id] = worker
+            return worker
+
+    def _ensure_loaded(self, worker, session_id, dataframes):
+        loaded, _ = worker.sessions.get(session_id, (None, 0))
+        same = (
+            loaded is not None
+            and loaded.keys() == dataframes.keys()
+            and all(loaded[k] is v for k, v in dataframes.items())
+        )
+        if same:
+            worker.sessions.move_to_end(session_id)
+            return
+
+        # Make room first, so that the new data doesn't push the worker over its cap
+        nbytes = sum(sizeof(df) for df in dataframes.values())
+        worker.sessions.pop(session_id, None)
+        max_data = self.max_rss * SESSION_DATA_SHARE if self.max_rss else None
+        while worker.sessions and (
+            len(worker.sessions) >= MAX_SESSIONS_PER_WORKER
+            or (max_data and worker.loaded_bytes + nbytes > max_data)
+        ):
+            oldest, _ = worker.sessions.popitem(last=False)
+            worker.request("drop", oldest, None, self.timeout, self.max_rss)
+
+        worker.request("load", session_id, dataframes, LOAD_TIMEOUT, self.max_rss)
+        worker.sessions[session_id] = (dict(dataframes), nbytes)
+
+    def run(self, session_id, dataframes: dict, code: str):
+        """Runs `code` for a session; returns (output, fig, evicted) like PythonKernel.run."""
+        worker = self._worker_for(session_id)
+        with worker.lock:
+            self._ensure_loaded(worker, session_id, dataframes)
+        output, fig_json, evicted, usage = worker.request("run", session_id, code, self.timeout, self.max_rss)
+        # Recorded on the caller's execute_python span
+        annotate(**usage)
+        fig = pio.from_json(fig_json) if fig_json else None
+        return output, fig, evicted
+
+    def reset(self, session_id):
+        """Drops the session's namespace; its data is reloaded on the next call."""
+        worker = self._worker_for(session_id)
+        with worker.lock:
+            if worker.sessions.pop(session_id, None) is not None:
+                worker.request("drop", session_id, None, self.timeout, self.max_rss)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+class SandboxKernel:
+    """
+    Drop-in replacement for `PythonKernel` that executes in a `SandboxPool`.
+    The dataframes are shipped to the session's worker on first use and
+    whenever they change.
+    """
+
+    def __init__(self, pool: SandboxPool, dataframes: dict = None, session_id: str = None):
+        self.pool = pool
+        self.session_id = session_id or uuid.uuid4().hex
+        self.dataframes = dict(dataframes or {})
+
+    def load(self, dataframes: dict):
+        self.dataframes = dict(dataframes)
+
+    def reset(self, dataframes: dict = None):
+        if dataframes is not None:
+            self.dataframes = dict(dataframes)
+        self.pool.reset(self.session_id)
+
+    def run(self, code: str):
+        return self.pool.run(self.session_id, self.dataframes, code)
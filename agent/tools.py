@@ -1,61 +1,114 @@
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-import sys
-from io import StringIO
-import contextlib
-
-@contextlib.contextmanager
-def stdoutIO(stdout=None):
-    old = sys.stdout
-    if stdout is None:
-        stdout = StringIO()
-    sys.stdout = stdout
-    yield stdout
-    sys.stdout = old
-
-def get_tools(dataframes: dict, shared_state: dict):
+
+from agent.kernel import PythonKernel
+from agent.output import OutputStore, compact_output, default_store
+from utils.db import SQL_MAX_ROWS, run_readonly_query
+from utils.tracing import span
+
+def get_run_context(config: RunnableConfig):
+    """Returns the (dataframes, shared_state) passed in ``config["configurable"]``."""
+    configurable = (config or {}).get("configurable", {})
+    dataframes = configurable.get("dataframes") or {}
+    shared_state = configurable.get("shared_state")
+    if shared_state is None:
+        shared_state = {}
+    return dataframes, shared_state
+
+def get_kernel(config: RunnableConfig) -> PythonKernel:
+    """
+    Returns the session's persistent kernel from ``config["configurable"]``.
+    Without one, a throwaway kernel holding only the dataframes is created.
+    """
+    configurable = (config or {}).get("configurable", {})
+    kernel = configurable.get("kernel")
+    if kernel is None:
+        dataframes, _ = get_run_context(config)
+        kernel = PythonKernel(dataframes)
+    return kernel
+
+def get_output_store(config: RunnableConfig) -> OutputStore:
+    """Returns the session's store for full tool outputs, or the process-wide one."""
+    store = (config or {}).get("configurable", {}).get("output_store")
+    return default_store if store is None else store
+
+def get_tools():
     """
-    Creates tools with access to the provided dataframes and shared state.
-    This avoids accessing st.session_state directly in threads.
+    Creates the agent tools.
+    The tools are stateless: the dataframes and shared state of the current
+    session are read from the RunnableConfig of each run, so the tools (and
+    the graph they are bound into) can be built once and reused.
+    This also avoids accessing st.session_state directly in threads.
     """
     
     @tool
-    def execute_python(code: str):
+    def execute_python(code: str, config: RunnableConfig):
         """Executes Python code. Use this to analyze data, create plots, etc.
         The code should be valid Python.
         You have access to `pd`, `px`, `go`, and any loaded dataframes (e.g., `df`).
+        Variables you define persist between calls, so reuse earlier results.
         If you create a Plotly figure, assign it to a variable named `fig`.
         """
+        _, shared_state = get_run_context(config)
+        kernel = get_kernel(config)
         try:
-            # Prepare the local namespace
-            local_vars = {
-                "pd": pd,
-                "px": px,
-                "go": go,
-            }
-            
-            # Inject dataframes
-            local_vars.update(dataframes)
+            # Execute the code in the session namespace and capture stdout
+            with span("execute_python", code_chars=len(code)) as run_span:
+                output, fig, evicted = kernel.run(code)
+                run_span.set(output_chars=len(output), figure=fig is not None, evicted=len(evicted))
+            output, _ = compact_output(output, get_output_store(config))
+
+            notes = ""
+            if evicted:
+                notes += f"\n\nNote: dropped {', '.join(evicted)} to stay within the session memory budget."
 
-            # Execute the code and capture stdout
-            with stdoutIO() as s:
-                exec(code, {}, local_vars)
-            
-            output = s.getvalue()
-            
             # Check for 'fig' variable
-            if "fig" in local_vars:
-                fig = local_vars["fig"]
-                shared_state["last_fig"] = fig
-                return f"Code executed successfully.\nOutput:\n{output}\n\nA plot was generated and saved to shared state."
+            if fig is not None:
+                # A list, as parallel tool calls may each produce a plot
+                shared_state.setdefault("figs", []).append(fig)
+                return f"Code executed successfully.\nOutput:\n{output}\n\nA plot was generated and saved to shared state.{notes}"
             
             if not output:
-                return "Code executed successfully, but produced no output. Did you forget to print()?"
+                return f"Code executed successfully, but produced no output. Did you forget to print()?{notes}"
 
-            return f"Code executed successfully.\nOutput:\n{output}"
+            return f"Code executed successfully.\nOutput:\n{output}{notes}"
         except Exception as e:
             return f"Error executing code: {e}"
 
-    return [execute_python]
+    @tool
+    def run_sql(query: str, config: RunnableConfig):
+        """Runs a single read-only SQL query (SELECT or WITH) directly on the connected database.
+        Use this to filter and aggregate full tables inside the database (COUNT, SUM, GROUP BY, ...)
+        instead of analyzing the sample loaded in `df`. Only small result sets are returned,
+        so always aggregate or add a LIMIT.
+        """
+        engine = (config or {}).get("configurable", {}).get("db_engine")
+        if engine is None:
+            return "No database is connected. Analyze the loaded dataframes with execute_python instead."
+        try:
+            with span("run_sql", dialect=engine.dialect.name) as sql_span:
+                df, truncated = run_readonly_query(engine, query)
+                sql_span.set(rows=len(df), truncated=truncated)
+        except Exception as e:
+            return f"Error executing query: {e}"
+
+        if df.empty:
+            return "Query executed successfully, but returned no rows."
+        output, _ = compact_output(df.to_string(index=False), get_output_store(config))
+        if truncated:
+            output += f"\n\n(Result truncated to the first {SQL_MAX_ROWS} rows. Aggregate further or add a LIMIT.)"
+        return f"Query executed successfully.\nResult ({len(df)} rows):\n{output}"
+
+    @tool
+    def read_output(output_id: str, page: int = 1, config: RunnableConfig = None):
+        """Reads a page of a tool output that was too long and got truncated.
+        `output_id` is the id given in the truncation note (e.g. 'out-3'); pages start at 1.
+        Prefer printing a narrower selection with execute_python when possible.
+        """
+        text, pages = get_output_store(config).page(output_id, page)
+        if text is None:
+            return f"No stored output named '{output_id}'."
+        page = min(max(1, page), pages)
+        return f"Output '{output_id}', page {page} of {pages}:\n{text}"
+
+    return [execute_python, run_sql, read_output]
@@ -1,16 +1,27 @@
 import streamlit as st
 import pandas as pd
 import os
+import uuid
 from dotenv import load_dotenv
 
-from agent.graph import get_agent_graph
-from utils.data_loader import load_data
-from utils.db import save_analysis
+from agent.graph import get_agent_graph, get_run_config
+from agent.figures import figure_from_json
+from agent.kernel import PythonKernel
+from agent.output import OutputStore
+from agent.result_cache import dataset_signature, extract_steps, get_result_cache, is_follow_up, rerun_steps
+from agent.sandbox import DEFAULT_WORKERS, SandboxKernel, SandboxPool
+from utils.data_loader import load_dataset
+from utils.streaming import STREAMING_THRESHOLD_MB, CsvDataset
+from utils.db import get_write_queue, save_analysis, save_message
+from utils.tracing import trace
 from langchain_core.messages import HumanMessage, AIMessage
 
 # Load environment variables
 load_dotenv()
 
+# Store every chat turn in the conversation_messages table
+PERSIST_MESSAGES = os.getenv("AUTOANALYTX_PERSIST_MESSAGES", "0") == "1"
+
 st.set_page_config(page_title="AutoAnalytx", layout="wide")
 
 # Custom CSS for better UI
@@ -30,6 +41,110 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_sandbox_pool():
+    """Starts the process-wide sandbox worker pool (None when disabled)."""
+    if DEFAULT_WORKERS <= 0:
+        return None
+    return SandboxPool()
+
+def new_kernel():
+    """Creates the session's Python kernel, sandboxed when the pool is enabled."""
+    pool = get_sandbox_pool()
+    if pool is None:
+        return PythonKernel()
+    return SandboxKernel(pool, session_id=st.session_state["session_id"])
+
+def stream_agent_run(graph, inputs, config, shared_state, status, answer_area):
+    """
+    Runs the agent, streaming the tokens of each LLM response into
+    `answer_area` as they arrive and tool progress into `status`.
+    Responses that turn out to call tools are moved into the status once
+    complete, so only the final answer stays in the chat.
+    Returns (generated_messages, final_response, generated_plots).
+    """
+    events = graph.stream(inputs, config, stream_mode=["messages", "updates"])
+    generated_messages = []
+    generated_plots = []
+    final_response = None
+    exhausted = False
+
+    def response_tokens():
+        # Yields the text of one LLM response and returns when its node has finished
+        nonlocal final_response, exhausted
+        for mode, payload in events:
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "agent" and isinstance(chunk.content, str) and chunk.content:
+                    yield chunk.content
+                continue
+
+            for key, value in payload.items():
+                new_msgs = (value or {}).get("messages", [])
+                generated_messages.extend(new_msgs)
+
+                if key == "tools":
+                    # Display tool output with per-call timing
+                    for msg in new_msgs:
+                        duration = msg.response_metadata.get("duration_s", 0)
+                        status.write(f"**Tool Output ({msg.name})** · {duration:.2f}s:")
+                        status.code(msg.content)
+                    if len(new_msgs) > 1:
+                        total = sum(m.response_metadata.get("duration_s", 0) for m in new_msgs)
+                        wall = new_msgs[0].response_metadata.get("batch_duration_s", 0)
+                        status.caption(f"Ran {len(new_msgs)} tool calls in parallel: {wall:.2f}s wall time vs {total:.2f}s sequential.")
+
+                # Check shared_state for plots after any step (agent or tool)
+                for fig in shared_state.pop("figs", []):
+                    generated_plots.append(fig)
+                    status.write("**Plot Generated**")
+
+                if key == "agent":
+                    msg = new_msgs[0]
+                    if msg.tool_calls:
+                        calls = ", ".join(call["name"] for call in msg.tool_calls)
+                        status.update(label=f"Running {calls}...")
+                    else:
+                        final_response = msg.content
+                    return
+        exhausted = True
+
+    while final_response is None and not exhausted:
+        with answer_area.container():
+            streamed = st.write_stream(response_tokens())
+        if final_response is None:
+            # The response called tools; its text was reasoning, not the answer
+            answer_area.empty()
+            if isinstance(streamed, str) and streamed.strip():
+                status.markdown(streamed)
+            status.update(label="Thinking...")
+
+    return generated_messages, final_response, generated_plots
+
+def render_debug_panel(turn_trace):
+    """Summarizes the trace of a chat turn in the sidebar."""
+    summary = turn_trace.summary()
+    with st.sidebar.expander("🐞 Last Turn", expanded=True):
+        col1, col2 = st.columns(2)
+        col1.metric("Wall time", f"{summary['wall_ms'] / 1000:.2f}s")
+        col2.metric("Iterations", summary["iterations"])
+        col1.metric("LLM", f"{summary['llm_ms'] / 1000:.2f}s")
+        col2.metric("Tools", f"{summary['tool_ms'] / 1000:.2f}s")
+        st.caption(
+            f"Tokens: {summary['input_tokens']:,} in / {summary['output_tokens']:,} out · "
+            f"Tool CPU: {summary['tool_cpu_ms']:.0f} ms · DB: {summary['db_ms']:.0f} ms · "
+            f"Peak RSS: {summary['peak_rss_mb']:.0f} MB"
+            + (f" · Sandbox worker RSS: {summary['worker_peak_rss_mb']:.0f} MB" if summary["worker_peak_rss_mb"] else "")
+        )
+        spans = pd.DataFrame([
+            {"span": s["name"], "ms": s["attributes"].get("duration_ms"), "cpu ms": s["attributes"].get("cpu_ms"),
+             "details": {k: v for k, v in s["attributes"].items() if k not in ("duration_ms", "cpu_ms")}}
+            for s in turn_trace.to_dicts()[1:]
+        ])
+        if not spans.empty:
+            spans["details"] = spans["details"].astype(str)
+            st.dataframe(spans, hide_index=True)
+
 def main():
     st.title("🤖 AutoAnalytx")
     st.caption("Your Intelligent Data Analytics Agent")
@@ -49,11 +164,35 @@ def main():
         
         if data_source == "Upload File":
             uploaded_file = st.file_uploader("Upload CSV or Excel", type=["csv", "xlsx", "xls"])
+            force_streaming = st.checkbox(
+                "Streaming mode",
+                help=f"Query the CSV out of core instead of loading it. Used automatically above {STREAMING_THRESHOLD_MB}MB.",
+            )
             if uploaded_file:
                 try:
-                    df = load_data(uploaded_file, uploaded_file.name.split(".")[-1])
-                    st.session_state["dataframes"] = {"df": df}
+                    # Parse only when a different file is uploaded, not on every rerun
+                    dataset_key = f"upload:{uploaded_file.file_id}:{force_streaming}"
+                    if st.session_state.get("dataset_key") != dataset_key:
+                        df, load_info = load_dataset(
+                            uploaded_file,
+                            uploaded_file.name.split(".")[-1],
+                            streaming=True if force_streaming else None,
+                        )
+                        # Out-of-core datasets are exposed to the agent as `data`, not `df`
+                        name = "df" if isinstance(df, pd.DataFrame) else "data"
+                        st.session_state["dataframes"] = {name: df}
+                        st.session_state["dataset_key"] = dataset_key
+                        st.session_state["load_info"] = load_info
+                    df = next(iter(st.session_state["dataframes"].values()))
                     st.success(f"Loaded {uploaded_file.name} with {len(df)} rows.")
+                    if isinstance(df, CsvDataset):
+                        st.caption("Streaming mode: the file is queried out of core with DuckDB.")
+                    report = st.session_state["load_info"].get("memory_report")
+                    if report:
+                        st.caption(
+                            f"Memory: {report['before_bytes'] / 1e6:.1f} MB → "
+                            f"{report['after_bytes'] / 1e6:.1f} MB after dtype optimization."
+                        )
                     st.dataframe(df.head())
                 except Exception as e:
                     st.error(f"Error loading file: {e}")
@@ -81,13 +220,22 @@ def main():
 
             if "db_engine" in st.session_state:
                 try:
-                    from utils.db import get_tables, load_table
-                    tables = get_tables(st.session_state["db_engine"])
-                    selected_table = st.selectbox("Select Table", tables)
+                    from utils.db import get_schema_catalog, load_table
+                    # TTL-cached, so reruns don't reflect the schema again
+                    catalog = get_schema_catalog(
+                        st.session_state["db_engine"],
+                        refresh=st.button("🔄 Refresh Schema"),
+                    )
+                    selected_table = st.selectbox(
+                        "Select Table",
+                        list(catalog),
+                        format_func=lambda t: t if catalog[t]["rows"] is None else f"{t} (~{catalog[t]['rows']:,} rows)",
+                    )
                     
                     if st.button("Load Table"):
                         df = load_table(st.session_state["db_engine"], selected_table, limit=5000)
                         st.session_state["dataframes"] = {"df": df}
+                        st.session_state["dataset_key"] = f"table:{selected_table}"
                         st.success(f"Loaded table '{selected_table}' with {len(df)} rows.")
                         st.dataframe(df.head())
                 except Exception as e:
@@ -95,7 +243,42 @@ def main():
 
         elif data_source == "Manual Input":
             st.info("Manually input data is not yet implemented.")
+
+        # Persistent Python namespace for this session's tool calls
+        if "session_id" not in st.session_state:
+            st.session_state["session_id"] = uuid.uuid4().hex
+        if "kernel" not in st.session_state:
+            st.session_state["kernel"] = new_kernel()
+        if "output_store" not in st.session_state:
+            st.session_state["output_store"] = OutputStore()
+        st.session_state["kernel"].load(st.session_state.get("dataframes", {}))
+        if st.button("🔄 Reset Python Session"):
+            st.session_state["kernel"].reset()
+            st.success("Python session variables cleared.")
             
+        output_ids = st.session_state["output_store"].ids()
+        if output_ids:
+            with st.expander("📄 Full Tool Outputs"):
+                output_id = st.selectbox("Output", output_ids[::-1])
+                page = st.number_input("Page", min_value=1, value=1, step=1)
+                text, pages = st.session_state["output_store"].page(output_id, int(page))
+                st.caption(f"Page {min(int(page), pages)} of {pages}")
+                st.code(text)
+
+        st.toggle("⚡ Reuse cached answers", value=True, key="use_result_cache",
+                  help="Answer repeated questions on the same data from the result cache.")
+        st.toggle("🐞 Debug panel", value=False, key="debug_panel",
+                  help="Show where the time of the last turn went.")
+
+        with st.expander("💾 Storage Writer"):
+            metrics = get_write_queue().metrics()
+            st.caption(
+                f"Queue depth: {metrics['queue_depth']} · Written: {metrics['rows_written']} · "
+                f"Failed: {metrics['rows_failed']} · Retries: {metrics['retries']}"
+            )
+            if metrics["last_flush_ms"] is not None:
+                st.caption(f"Last flush: {metrics['last_flush_ms']:.0f} ms · Max: {metrics['max_flush_ms']:.0f} ms")
+
         st.divider()
         with st.expander("ℹ️ Instructions & About"):
             st.markdown("""
@@ -113,7 +296,7 @@ def main():
             - **Tools**: Pandas, Plotly, Scikit-learn
             
             **Limitations:**
-            - **Data Size**: Large files (>200MB) may encounter issues.
+            - **Data Size**: Large CSV files are analyzed in streaming mode (DuckDB), which supports SQL aggregations and chunked pandas processing rather than a full `df`.
             - **LLM Accuracy**: The agent writes code to answer queries; complex logic may require refinement.
             - **Security**: Database credentials are not stored persistently but ensure you trust the environment.
             """)
@@ -123,7 +306,7 @@ def main():
         st.session_state["messages"] = []
 
     # Display Chat Messages
-    for msg in st.session_state["messages"]:
+    for i, msg in enumerate(st.session_state["messages"]):
         if isinstance(msg, HumanMessage):
             with st.chat_message("user"):
                 st.write(msg.content)
@@ -134,7 +317,11 @@ def main():
                     st.write(msg.content)
                     # Check if there was a plot associated with this message
                     if "plot" in msg.additional_kwargs:
-                        st.plotly_chart(msg.additional_kwargs["plot"])
+                        plot = msg.additional_kwargs["plot"]
+                        if isinstance(plot, str):
+                            plot = figure_from_json(plot)
+                        # Keyed, as a replayed answer repeats the same figure
+                        st.plotly_chart(plot, key=f"history-plot-{i}")
 
     # Chat Input
     if prompt := st.chat_input("Ask a question about your data..."):
@@ -158,7 +345,15 @@ def main():
                 # Get dataframes from session state
                 dataframes = st.session_state.get("dataframes", {})
 
-                graph = get_agent_graph(api_key, dataframes, shared_state)
+                # The graph is built once per API key; session data goes in the run config
+                graph = get_agent_graph(api_key)
+                config = get_run_config(
+                    dataframes,
+                    shared_state,
+                    st.session_state.get("kernel"),
+                    st.session_state.get("db_engine"),
+                    st.session_state["output_store"],
+                )
                 # Prepare inputs
                 inputs = {"messages": st.session_state["messages"]}
                 
@@ -166,47 +361,78 @@ def main():
                 generated_messages = []
                 final_response = None
                 generated_plots = []
-                
-                with st.status("Thinking...", expanded=True) as status:
-                    for event in graph.stream(inputs):
-                        for key, value in event.items():
-                            if "messages" in value:
-                                new_msgs = value["messages"]
-                                generated_messages.extend(new_msgs)
-                            
-                            if key == "agent":
-                                msg = value["messages"][0]
-                                if not msg.tool_calls:
-                                    final_response = msg.content
-                            
-                            elif key == "tools":
-                                # Display tool output
-                                for msg in value["messages"]:
-                                    status.write(f"**Tool Output ({msg.name})**:")
-                                    status.code(msg.content)
-
-                            # Check shared_state for plots after any step (agent or tool)
-                            if "last_fig" in shared_state:
-                                fig = shared_state["last_fig"]
-                                generated_plots.append(fig)
-                                status.write("**Plot Generated**")
-                                del shared_state["last_fig"]
+                streamed_answer = False
+
+                # Repeated questions on the same data are answered from the result cache
+                result_cache = get_result_cache()
+                use_cache = st.session_state.get("use_result_cache", True)
+                earlier_questions = [m.content for m in st.session_state["messages"][:-1] if isinstance(m, HumanMessage)]
+                # Only follow-ups depend on the previous question
+                cache_context = earlier_questions[-1] if earlier_questions and is_follow_up(prompt) else ""
+                cached = None
+                if use_cache:
+                    fingerprint, schema = dataset_signature(dataframes, st.session_state.get("db_engine"))
+                    cached = result_cache.lookup(fingerprint, schema, prompt, cache_context)
 
+                if cached is not None and not cached["stale"]:
+                    final_response = cached["answer"]
+                    generated_plots = [figure_from_json(fig_json) for fig_json in cached["figures"]]
+                    generated_messages = [AIMessage(content=final_response, additional_kwargs={"cached": True})]
+                    st.caption("⚡ Answered from the result cache.")
+                elif cached is not None:
+                    # Same question on changed data: replay the cached code, not the answer
+                    with st.status("Re-running the cached analysis on the current data...", expanded=True) as status:
+                        outputs = rerun_steps(cached["steps"], config)
+                        for output in outputs:
+                            status.code(output)
+                        generated_plots = shared_state.pop("figs", [])
+                        status.update(label="Analysis Complete", state="complete", expanded=False)
+                    final_response = (
+                        "The data changed since this question was last answered, so the earlier "
+                        "analysis was re-run on the current data:\n\n"
+                        + "\n\n".join(f"```\n{output}\n```" for output in outputs)
+                    )
+                    generated_messages = [AIMessage(content=final_response, additional_kwargs={"cached": True})]
+                else:
+                    # Answer tokens stream in below the status while tools report into it
+                    status = st.status("Thinking...", expanded=True)
+                    answer_area = st.empty()
+                    with trace("chat_turn", session_id=st.session_state["session_id"]) as turn_trace:
+                        generated_messages, final_response, generated_plots = stream_agent_run(
+                            graph, inputs, config, shared_state, status, answer_area
+                        )
+                    st.session_state["last_trace"] = turn_trace
                     status.update(label="Analysis Complete", state="complete", expanded=False)
+                    streamed_answer = True
+
+                if use_cache and final_response and (cached is None or cached["stale"]):
+                    result_cache.store(
+                        fingerprint, schema, prompt, final_response,
+                        steps=cached["steps"] if cached else extract_steps(generated_messages),
+                        figures=[fig.to_json() for fig in generated_plots],
+                        context=cache_context,
+                    )
                 
                 # Append all generated messages to session state
                 st.session_state["messages"].extend(generated_messages)
 
+                if PERSIST_MESSAGES and final_response:
+                    # For demo, we use user_id=1. Queued, so this never blocks the UI.
+                    save_message(1, st.session_state["session_id"], "user", prompt)
+                    save_message(1, st.session_state["session_id"], "assistant", final_response)
+
                 if final_response:
-                    st.write(final_response)
+                    if not streamed_answer:
+                        st.write(final_response)
                     
                     # Display generated plots
-                    for fig in generated_plots:
-                        st.plotly_chart(fig)
+                    for j, fig in enumerate(generated_plots):
+                        st.plotly_chart(fig, key=f"plot-{j}")
                     
-                    # Save to history with plots (associate with last message)
+                    # Save to history with plots (associate with last message).
+                    # Stored as compact JSON; rebuilt once and cached when the chat is redrawn.
                     if generated_plots and isinstance(st.session_state["messages"][-1], AIMessage):
-                        st.session_state["messages"][-1].additional_kwargs["plot"] = generated_plots[0]
+                        st.session_state["messages"][-1].additional_kwargs["plot"] = generated_plots[0].to_json()
                     
                     # Options to save/download
                     col1, col2 = st.columns(2)
@@ -214,7 +440,6 @@ def main():
                         if st.button("💾 Save Analysis to TiDB"):
                             # For demo, we use user_id=1. In real app, get from login.
                             try:
-                                from utils.db import save_analysis
                                 import json
                                 
                                 # Serialize plot if available
@@ -223,8 +448,9 @@ def main():
                                 # Simplified: We don't have the plot object here easily unless we stored it in a specific way for saving.
                                 # For now, we just save the text.
                                 
+                                # Written in the background by the write-behind queue
                                 save_analysis(1, prompt, final_response, viz_json)
-                                st.success("Analysis saved to database!")
+                                st.success("Analysis queued for saving to the database!")
                             except Exception as e:
                                 st.error(f"Failed to save: {e}")
                     
@@ -239,5 +465,9 @@ def main():
             except Exception as e:
                 st.error(f"An error occurred: {e}")
 
+    # Rendered last so it reflects the turn that just ran
+    if st.session_state.get("debug_panel") and "last_trace" in st.session_state:
+        render_debug_panel(st.session_state["last_trace"])
+
 if __name__ == "__main__":
     main()
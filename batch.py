@@ -0,0 +1,171 @@
+"""
+Headless runner: answers a file of questions about one dataset with the
+agent graph, outside Streamlit.
+
+    python batch.py --data sales.csv --questions questions.txt --out answers.jsonl
+    python batch.py --db-url mysql+mysqlconnector://... --table orders \
+        --questions questions.jsonl --out answers.parquet --concurrency 8
+
+Questions are read one per line from a text file, or from the "question"
+field (and optional "id") of a JSONL file. Every question is an independent
+conversation with its own Python kernel.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage
+
+from agent.graph import arun, get_run_config
+from agent.kernel import PythonKernel
+from agent.output import OutputStore
+from agent.result_cache import extract_steps
+from agent.sandbox import SandboxKernel, SandboxPool
+from utils.data_loader import load_dataset
+from utils.db import get_engine, load_table
+from utils.streaming import CsvDataset
+from utils.tracing import trace
+
+DEFAULT_CONCURRENCY = 4
+
+def read_questions(path: str) -> list:
+    """Returns [(id, question)] from a text file (one per line) or a JSONL file."""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                questions.append((str(record.get("id", number)), record["question"]))
+            else:
+                questions.append((str(number), line))
+    return questions
+
+def load_source(args):
+    """Returns (dataframes, db_engine) for the dataset named on the command line."""
+    if args.data:
+        file_type = os.path.splitext(args.data)[1].lstrip(".").lower()
+        with open(args.data, "rb") as f:
+            df, _ = load_dataset(f, file_type, streaming=True if args.streaming else None)
+        name = "data" if isinstance(df, CsvDataset) else "df"
+        return {name: df}, None
+
+    engine = get_engine(args.db_url)
+    if not args.table:
+        # The agent queries the database itself with run_sql
+        return {}, engine
+    return {"df": load_table(engine, args.table, limit=args.limit)}, engine
+
+async def answer(api_key, question_id, question, dataframes, db_engine, pool, semaphore):
+    """Runs one question through the agent and returns its result record."""
+    async with semaphore:
+        shared_state = {}
+        kernel = SandboxKernel(pool, dataframes) if pool else PythonKernel(dataframes)
+        config = get_run_config(dataframes, shared_state, kernel, db_engine, OutputStore())
+        record = {"id": question_id, "question": question}
+        start = time.perf_counter()
+        try:
+            with trace("batch_question", question_id=question_id) as question_trace:
+                messages = await arun(api_key, [HumanMessage(content=question)], config)
+            steps = extract_steps(messages)
+            record.update({
+                "answer": messages[-1].content if messages else None,
+                "code": [args["code"] for name, args in steps if name == "execute_python"],
+                "sql": [args["query"] for name, args in steps if name == "run_sql"],
+                "figures": [fig.to_json() for fig in shared_state.get("figs", [])],
+                "tool_calls": len(steps),
+                "trace": question_trace.summary(),
+                "error": None,
+            })
+        except Exception as e:
+            record.update({
+                "answer": None, "code": [], "sql": [], "figures": [], "tool_calls": 0, "trace": None, "error": str(e),
+            })
+        finally:
+            if pool:
+                # Frees the session's namespace in its worker
+                kernel.reset()
+        record["duration_s"] = time.perf_counter() - start
+        return record
+
+async def run_batch(args, api_key: str) -> list:
+    dataframes, db_engine = load_source(args)
+    questions = read_questions(args.questions)
+    pool = SandboxPool() if args.sandbox else None
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    tasks = [
+        answer(api_key, question_id, question, dataframes, db_engine, pool, semaphore)
+        for question_id, question in questions
+    ]
+    records = []
+    jsonl = open(args.out, "w", encoding="utf-8") if args.format == "jsonl" else None
+    try:
+        for task in asyncio.as_completed(tasks):
+            record = await task
+            records.append(record)
+            if jsonl:
+                # Written as they finish, so a long run can be followed and survives a crash
+                jsonl.write(json.dumps(record) + "\n")
+                jsonl.flush()
+            status = "error" if record["error"] else "ok"
+            print(f"[{len(records)}/{len(tasks)}] {record['id']}: {status} in {record['duration_s']:.1f}s", file=sys.stderr)
+    finally:
+        if jsonl:
+            jsonl.close()
+        if pool:
+            pool.shutdown()
+
+    if args.format == "parquet":
+        pd.DataFrame(records).to_parquet(args.out, index=False)
+    return records
+
+def summarize(records: list, wall_time: float) -> str:
+    durations = pd.Series([r["duration_s"] for r in records])
+    failed = sum(1 for r in records if r["error"])
+    return (
+        f"{len(records)} questions in {wall_time:.1f}s ({failed} failed) · "
+        f"latency p50 {durations.quantile(0.5):.1f}s, p95 {durations.quantile(0.95):.1f}s, "
+        f"max {durations.max():.1f}s"
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a suite of questions through the AutoAnalytx agent.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--data", help="CSV or Excel file to analyze")
+    source.add_argument("--db-url", help="SQLAlchemy URL of the database to analyze")
+    parser.add_argument("--table", help="Table loaded as `df` (with --db-url)")
+    parser.add_argument("--limit", type=int, default=5000, help="Rows loaded from --table (default: 5000)")
+    parser.add_argument("--streaming", action="store_true", help="Open --data in streaming mode")
+    parser.add_argument("--questions", required=True, help="Text file (one question per line) or JSONL file")
+    parser.add_argument("--out", required=True, help="Output file (.jsonl or .parquet)")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="Output format (default: from --out)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Questions run at the same time (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--sandbox", action="store_true", help="Run the generated code in sandbox worker processes")
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = "parquet" if args.out.endswith(".parquet") else "jsonl"
+    return args
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        print("GROQ_API_KEY is not set.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    records = asyncio.run(run_batch(args, api_key))
+    print(summarize(records, time.perf_counter() - start), file=sys.stderr)
+    return 1 if any(r["error"] for r in records) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Offline benchmarks: measures the agent's hot paths without calling Groq.
+
+    python benchmark.py --out bench.json
+    python benchmark.py --compare baseline.json --tolerance 0.25
+
+The LLM is replaced by a scripted chat model that replays fixed tool calls,
+so results are deterministic and reflect only this project's code. The DB
+benchmarks use a temporary SQLite file unless --db-url points at a stand-in
+database (e.g. a local Postgres). With --compare, the run exits with status 1
+when a benchmark got slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import cycle
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from sqlalchemy import text
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_REPEAT = 5
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model that replays `script` in a loop, ignoring its input."""
+
+    script: list
+    _replies = None
+    _lock = None
+
+    def model_post_init(self, context):
+        self._replies = cycle(self.script)
+        self._lock = Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._lock:
+            reply = next(self._replies)
+        return ChatResult(generations=[ChatGeneration(message=reply.model_copy(deep=True))])
+
+def tool_turn(code: str, answer: str = "Done.") -> list:
+    """Script of one turn: a single execute_python call, then the final answer."""
+    return [
+        AIMessage(content="", tool_calls=[{"name": "execute_python", "args": {"code": code}, "id": "call_1"}]),
+        AIMessage(content=answer),
+    ]
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    """Runs `fn` `warmup` + `repeat` times and returns timing statistics in ms."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples = np.array(samples)
+    return {
+        "n": repeat,
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+    }
+
+def sample_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(["north", "south", "east", "west"], rows),
+        "product": rng.choice([f"product_{i}" for i in range(50)], rows),
+        "quantity": rng.integers(1, 20, rows),
+        "price": rng.random(rows).round(2) * 100,
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+    })
+
+def bench_graph(results, repeat):
+    from agent.graph import build_agent_graph, get_agent_graph
+    from agent import graph as graph_module
+
+    llm = ScriptedChatModel(script=[AIMessage(content="Done.")])
+    results["graph_build"] = measure(lambda: build_agent_graph(llm), repeat)
+
+    # Cached lookup used on every chat turn
+    original = graph_module.get_llm
+    graph_module.get_llm = lambda api_key: llm
+    try:
+        get_agent_graph.cache_clear()
+        results["graph_cached_lookup"] = measure(lambda: get_agent_graph("benchmark"), repeat * 100)
+    finally:
+        graph_module.get_llm = original
+        get_agent_graph.cache_clear()
+
+def bench_execute_python(results, repeat):
+    from agent.graph import get_run_config
+    from agent.kernel import PythonKernel
+    from agent.tools import get_tools
+
+    df = sample_frame(100_000)
+    kernel = PythonKernel({"df": df})
+    execute_python = next(t for t in get_tools() if t.name == "execute_python")
+    config = get_run_config({"df": df}, {}, kernel)
+
+    def call(code):
+        return lambda: execute_python.invoke({"code": code}, config)
+
+    results["kernel_run_noop"] = measure(lambda: kernel.run("pass"), repeat * 20)
+    results["execute_python_noop"] = measure(call("pass"), repeat * 20)
+    results["execute_python_groupby"] = measure(call("print(df.groupby('region')['price'].sum())"), repeat)
+    results["execute_python_print_df"] = measure(call("print(df)"), repeat)
+    results["execute_python_plot"] = measure(call("fig = px.histogram(df.head(10000), x='price')"), repeat)
+
+def bench_load_data(results, repeat, sizes, workdir):
+    from utils import data_loader
+    from utils.data_loader import load_data, load_dataset
+
+    for rows in sizes:
+        path = os.path.join(workdir, f"data_{rows}.csv")
+        sample_frame(rows).to_csv(path, index=False)
+        size_repeat = max(1, repeat // (1 + rows // 500_000))
+
+        def parse(fast):
+            with open(path, "rb") as f:
+                load_data(f, "csv", fast=fast)
+
+        results[f"load_data_{rows}"] = measure(lambda: parse(False), size_repeat)
+        results[f"load_data_fast_{rows}"] = measure(lambda: parse(True), size_repeat)
+
+        def cached_load():
+            with open(path, "rb") as f:
+                load_dataset(f, "csv", fast=True, streaming=False)
+
+        results[f"load_dataset_cached_{rows}"] = measure(cached_load, repeat)
+        data_loader._datasets.clear()
+
+def bench_db(results, repeat, workdir, db_url=None):
+    from utils.db import get_engine, get_schema_catalog, load_table, run_readonly_query
+
+    url = db_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    engine = get_engine(url)
+    sample_frame(200_000).to_sql("bench_orders", engine, if_exists="replace", index=False, chunksize=50_000)
+    try:
+        results["db_schema_reflect"] = measure(lambda: get_schema_catalog(engine, refresh=True), repeat)
+        results["db_schema_cached"] = measure(lambda: get_schema_catalog(engine), repeat * 100)
+        results["db_load_table_5000"] = measure(lambda: load_table(engine, "bench_orders", limit=5000), repeat)
+        results["db_run_sql_aggregate"] = measure(
+            lambda: run_readonly_query(engine, "SELECT region, SUM(price * quantity) AS revenue FROM bench_orders GROUP BY region"),
+            repeat,
+        )
+        results["db_run_sql_rows"] = measure(lambda: run_readonly_query(engine, "SELECT * FROM bench_orders"), repeat)
+    finally:
+        if db_url:
+            with engine.begin() as connection:
+                connection.execute(text("DROP TABLE bench_orders"))
+
+def bench_storage_writes(results, repeat, workdir):
+    from utils import db
+
+    url = f"sqlite:///{os.path.join(workdir, 'storage.db')}"
+    os.environ["AUTOANALYTX_STORAGE_URL"] = url
+    with db.get_engine(url).begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS saved_analyses (id INTEGER PRIMARY KEY, user_id INT, "
+            "query TEXT, result_summary TEXT, visualization_json TEXT)"
+        ))
+    queue = db.get_write_queue()
+    results["save_analysis_enqueue"] = measure(lambda: db.save_analysis(1, "question", "answer"), repeat * 200)
+
+    def write_batch():
+        for _ in range(500):
+            db.save_analysis(1, "question", "answer")
+        queue.flush()
+
+    results["save_analysis_500_flushed"] = measure(write_batch, repeat)
+
+def bench_end_to_end(results, repeat):
+    from agent.graph import build_agent_graph, get_run_config
+    from agent.kernel import PythonKernel
+
+    df = sample_frame(100_000)
+    scenarios = {
+        "turn_answer_only": [AIMessage(content="The dataset has 100000 rows.")],
+        "turn_one_tool_call": tool_turn("print(df.groupby('region')['price'].mean())"),
+        "turn_plot": tool_turn("fig = px.bar(df.groupby('region')['price'].sum().reset_index(), x='region', y='price')"),
+    }
+    for name, script in scenarios.items():
+        graph = build_agent_graph(ScriptedChatModel(script=script))
+        kernel = PythonKernel({"df": df})
+
+        def turn():
+            config = get_run_config({"df": df}, {}, kernel)
+            graph.invoke({"messages": [HumanMessage(content="What is the average price per region?")]}, config)
+
+        results[f"e2e_{name}"] = measure(turn, repeat)
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the benchmarks whose median got slower than the baseline by more than `tolerance`."""
+    regressions = []
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if before and before["p50_ms"] > 0:
+            ratio = stats["p50_ms"] / before["p50_ms"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name}: {before['p50_ms']:.2f} ms -> {stats['p50_ms']:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AutoAnalytx offline with a scripted LLM.")
+    parser.add_argument("--out", help="Write results as JSON to this file (default: stdout)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="CSV row counts for load_data")
+    parser.add_argument("--db-url", help="Database for the DB benchmarks instead of a temporary SQLite file")
+    parser.add_argument("--only", nargs="+", choices=["graph", "execute", "load", "db", "storage", "e2e"],
+                        help="Run only these groups")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs the baseline (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    groups = set(args.only or ["graph", "execute", "load", "db", "storage", "e2e"])
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="autoanalytx-bench-") as workdir:
+        # Spilled Parquet files of the load benchmarks are cleaned up with the rest
+        os.environ.setdefault("AUTOANALYTX_SPILL_DIR", workdir)
+        steps = [
+            ("graph", lambda: bench_graph(results, args.repeat)),
+            ("execute", lambda: bench_execute_python(results, args.repeat)),
+            ("load", lambda: bench_load_data(results, args.repeat, args.sizes, workdir)),
+            ("db", lambda: bench_db(results, args.repeat, workdir, args.db_url)),
+            ("storage", lambda: bench_storage_writes(results, args.repeat, workdir)),
+            ("e2e", lambda: bench_end_to_end(results, args.repeat)),
+        ]
+        for group, run in steps:
+            if group in groups:
+                print(f"Running {group} benchmarks...", file=sys.stderr)
+                run()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,282 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 import io
 
-def load_csv(file) -> pd.DataFrame:
-    """Loads a CSV file into a Pandas DataFrame."""
+from utils.profile import get_profile
+from utils.streaming import STREAMING_THRESHOLD_MB, live_dataset_paths, open_csv_dataset
+from utils.tracing import span
+
+# Parsed datasets kept in memory across reruns and sessions, keyed by content hash.
+DATASET_CACHE_MAX_MB = int(os.getenv("AUTOANALYTX_DATASET_CACHE_MB", "2048"))
+DATASET_CACHE_MAX_ENTRIES = 16
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Fast ingest: Arrow CSV parsing, compact dtypes and a Parquet copy of each dataset.
+# Off by default: categorical columns reject values they have not seen.
+FAST_INGEST = os.getenv("AUTOANALYTX_FAST_INGEST", "0") == "1"
+SPILL_DIR = os.getenv("AUTOANALYTX_SPILL_DIR", os.path.join(tempfile.gettempdir(), "autoanalytx"))
+# Disk used by Parquet spills and streaming copies before the least recently used are deleted.
+SPILL_DIR_MAX_MB = int(os.getenv("AUTOANALYTX_SPILL_DIR_MAX_MB", "10240"))
+# String columns with at most this share of distinct values become categoricals.
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+_datasets = OrderedDict()  # key -> (DataFrame, memory in bytes)
+_datasets_lock = threading.Lock()
+_spill_lock = threading.Lock()
+
+def load_csv(file, fast: bool = False) -> pd.DataFrame:
+    """Loads a CSV file into a Pandas DataFrame.
+    With fast=True the multithreaded pyarrow parser is used, falling back to
+    the default parser for files it cannot handle.
+    """
+    if fast:
+        try:
+            return pd.read_csv(file, engine="pyarrow")
+        except ValueError:
+            file.seek(0)
     return pd.read_csv(file)
 
 def load_excel(file) -> pd.DataFrame:
     """Loads an Excel file into a Pandas DataFrame."""
     return pd.read_excel(file)
 
-def load_data(file_obj, file_type: str) -> pd.DataFrame:
-    """Dispatcher for loading data based on file type."""
+def _read(file_obj, file_type: str, fast: bool = False) -> pd.DataFrame:
     if file_type == "csv":
-        return load_csv(file_obj)
+        return load_csv(file_obj, fast=fast)
     elif file_type == "xlsx" or file_type == "xls":
         return load_excel(file_obj)
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Returns the memory used by a DataFrame, in bytes."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def optimize_dtypes(df: pd.DataFrame):
+    """
+    Shrinks a DataFrame: low-cardinality strings become categoricals and floats
+    are downcast only when no precision is lost. Integers stay 64-bit, since
+    arithmetic on narrower ones overflows silently.
+    Returns (df, report) with the memory used before and after, in bytes.
+    """
+    before = memory_usage(df)
+    converted = {}
+    for name in df.columns:
+        series = df[name]
+        dtype = series.dtype
+        if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            if len(series) == 0:
+                continue
+            try:
+                unique = series.nunique(dropna=True)
+            except TypeError:
+                continue
+            if unique / len(series) <= CATEGORY_MAX_UNIQUE_RATIO:
+                df[name] = series.astype("category")
+        elif pd.api.types.is_float_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            downcast = series.astype("float32")
+            if ((downcast.astype(dtype) == series) | series.isna()).all():
+                df[name] = downcast
+        if df[name].dtype != dtype:
+            converted[str(name)] = f"{dtype} -> {df[name].dtype}"
+
+    report = {"before_bytes": before, "after_bytes": memory_usage(df), "converted": converted}
+    return df, report
+
+def load_data(file_obj, file_type: str, fast: bool = False) -> pd.DataFrame:
+    """Dispatcher for loading data based on file type.
+    With fast=True, CSVs go through the Arrow parser and dtypes are compacted.
+    """
+    with span("load_data", file_type=file_type, fast=fast) as load_span:
+        df = _read(file_obj, file_type, fast=fast)
+        if fast:
+            df, _ = optimize_dtypes(df)
+        # Profile once at load time so the agent prompt gets it from the cache
+        get_profile(df)
+        load_span.set(rows=len(df), memory_bytes=memory_usage(df))
+    return df
+
+def _spill_path(key: str) -> str:
+    return os.path.join(SPILL_DIR, f"{key}.parquet")
+
+def _touch(path: str):
+    """Marks a spilled file as recently used, for `evict_spills`."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def evict_spills(max_mb: int = None):
+    """
+    Deletes the least recently used Parquet spills and streaming copies
+    (CSV, DuckDB file and profile of a dataset together) until SPILL_DIR
+    fits `max_mb`. Datasets still in use are kept: those in the in-memory
+    cache, those with a live `CsvDataset` handle (held by a session or a
+    sandbox assignment) and those with a file still being written.
+    """
+    max_bytes = (SPILL_DIR_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    with _datasets_lock:
+        in_use = {key.split(".", 1)[0] for key in _datasets}
+    in_use.update(os.path.basename(path).split(".", 1)[0] for path in live_dataset_paths())
+    with _spill_lock:
+        try:
+            entries = list(os.scandir(SPILL_DIR))
+        except FileNotFoundError:
+            return
+        # Every file of a dataset starts with its content hash
+        groups = {}
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            group = groups.setdefault(entry.name.split(".", 1)[0], {"paths": [], "bytes": 0, "used": 0})
+            group["paths"].append(entry.path)
+            group["bytes"] += stat.st_size
+            group["used"] = max(group["used"], stat.st_mtime)
+            if entry.name.endswith(".tmp"):
+                in_use.add(entry.name.split(".", 1)[0])
+        total = sum(group["bytes"] for group in groups.values())
+        for name, group in sorted(groups.items(), key=lambda item: item[1]["used"]):
+            if total <= max_bytes:
+                break
+            if name in in_use:
+                continue
+            for path in group["paths"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= group["bytes"]
+
+def read_spill(key: str):
+    """Returns the Parquet copy of a dataset, memory-mapped, or None if there is none."""
+    path = _spill_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path, memory_map=True)
+    except Exception:
+        return None
+    _touch(path)
+    return df
+
+def write_spill(key: str, df: pd.DataFrame):
+    """Writes a Parquet copy of a dataset so later loads skip parsing.
+    Frames Parquet cannot represent (e.g. mixed-type columns) are not spilled.
+    """
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    path = _spill_path(key)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def content_hash(file_obj) -> str:
+    """Hashes the contents of a file-like object and rewinds it."""
+    digest = hashlib.blake2b(digest_size=20)
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+def _evict_datasets():
+    """Drops least recently used datasets above the entry count or memory ceiling."""
+    max_bytes = DATASET_CACHE_MAX_MB * 1024 * 1024
+    total = sum(nbytes for _, nbytes in _datasets.values())
+    # The most recent dataset is always kept, even when it alone exceeds the ceiling
+    while len(_datasets) > 1 and (total > max_bytes or len(_datasets) > DATASET_CACHE_MAX_ENTRIES):
+        _, (_, nbytes) = _datasets.popitem(last=False)
+        total -= nbytes
+
+def _file_size(file_obj) -> int:
+    position = file_obj.tell()
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    file_obj.seek(position)
+    return size
+
+def _save_upload(file_obj, path: str):
+    """Copies a file-like object to `path` in chunks, unless it is already there."""
+    if os.path.exists(path):
+        _touch(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    file_obj.seek(0)
+    with open(tmp_path, "wb") as out:
+        for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+            out.write(chunk)
+    file_obj.seek(0)
+    os.replace(tmp_path, path)
+
+def load_dataset(file_obj, file_type: str, fast: bool = FAST_INGEST, streaming: bool = None):
+    """
+    Loads a file through an in-memory cache keyed by its content hash.
+    Returns (df, info) where info holds the cache key, where the frame came
+    from ("memory", "spill", "parse" or "streaming"), and its memory usage in bytes. The
+    same DataFrame object is returned for identical contents, so callers must
+    not modify it in place.
+    In fast mode a parsed file is compacted with `optimize_dtypes` (info then
+    includes its "memory_report") and spilled to Parquet, so a later load of
+    the same contents, e.g. after eviction or a restart, is memory-mapped
+    instead of re-parsed. Files on disk are capped at SPILL_DIR_MAX_MB.
+    In streaming mode (forced with streaming=True, or automatic for CSVs over
+    STREAMING_THRESHOLD_MB) the file is saved to disk and a
+    `utils.streaming.CsvDataset` handle is returned instead of a DataFrame.
+    """
+    with span("load_dataset", file_type=file_type) as load_span:
+        if streaming is None:
+            streaming = file_type == "csv" and _file_size(file_obj) > STREAMING_THRESHOLD_MB * 1024 * 1024
+        key = f"{content_hash(file_obj)}.{file_type}"
+        cache_key = f"{key}:streaming" if streaming else key
+        with _datasets_lock:
+            if cache_key in _datasets:
+                _datasets.move_to_end(cache_key)
+                df, nbytes = _datasets[cache_key]
+                load_span.set(source="memory")
+                return df, {"key": key, "source": "memory", "memory_bytes": nbytes}
+
+        info = {"key": key}
+        if streaming:
+            if file_type != "csv":
+                raise ValueError("Streaming mode is only available for CSV files.")
+            csv_path = os.path.join(SPILL_DIR, key)
+            _save_upload(file_obj, csv_path)
+            df = open_csv_dataset(csv_path)
+            info["source"] = "streaming"
+            # Only the handle and its profile are held in memory
+            nbytes = 0
+        else:
+            df = read_spill(key) if fast else None
+            if df is not None:
+                info["source"] = "spill"
+                nbytes = memory_usage(df)
+            else:
+                info["source"] = "parse"
+                df = _read(file_obj, file_type, fast=fast)
+                if fast:
+                    df, report = optimize_dtypes(df)
+                    info["memory_report"] = report
+                    nbytes = report["after_bytes"]
+                    write_spill(key, df)
+                else:
+                    nbytes = memory_usage(df)
+            get_profile(df)
+
+        info["memory_bytes"] = nbytes
+        load_span.set(source=info["source"], memory_bytes=nbytes)
+        with _datasets_lock:
+            _datasets[cache_key] = (df, nbytes)
+            _evict_datasets()
+        if streaming or fast:
+            evict_spills()
+        return df, info
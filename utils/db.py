@@ -1,8 +1,43 @@
 import os
+import re
+import threading
+import time
 import pandas as pd
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker
-import streamlit as st
+
+from utils.profile import get_profile
+from utils.tracing import span
+from utils.write_queue import WriteBehindQueue
+
+# Connection pool settings shared by every engine in the registry.
+POOL_SIZE = int(os.getenv("AUTOANALYTX_DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("AUTOANALYTX_DB_MAX_OVERFLOW", "10"))
+# Recycle connections before MySQL/TiDB servers drop idle ones.
+POOL_RECYCLE = int(os.getenv("AUTOANALYTX_DB_POOL_RECYCLE", "1800"))
+# Seconds a reflected schema catalog is reused before querying the database again.
+SCHEMA_CACHE_TTL = int(os.getenv("AUTOANALYTX_SCHEMA_CACHE_TTL", "300"))
+# Tables listed in the agent prompt.
+MAX_PROMPT_TABLES = 50
+
+_engines = {}
+_engines_lock = threading.Lock()
+_catalogs = {}  # engine -> (expiry time, catalog)
+_catalogs_lock = threading.Lock()
+
+# Limits for agent-issued SQL (see run_readonly_query).
+SQL_MAX_ROWS = int(os.getenv("AUTOANALYTX_SQL_MAX_ROWS", "1000"))
+SQL_TIMEOUT = int(os.getenv("AUTOANALYTX_SQL_TIMEOUT", "30"))
+SQL_FETCH_SIZE = 500
+
+_READ_ONLY_STATEMENTS = ("select", "with", "show", "describe", "desc", "explain")
+# Writes that can hide inside a statement starting with SELECT/WITH (CTEs,
+# SELECT ... INTO, FOR UPDATE); the read-only transaction is the main guard.
+_WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|create|alter|drop|truncate|grant|revoke|call|into|lock|attach|detach|pragma)\b",
+    re.IGNORECASE,
+)
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|--[^\n]*|/\*.*?\*/", re.DOTALL)
 
 def get_connection_string(db_type, host, port, user, password, database):
     """Constructs the database connection string based on type."""
@@ -13,11 +48,29 @@ def get_connection_string(db_type, host, port, user, password, database):
     else:
         raise ValueError(f"Unsupported database type: {db_type}")
 
+def get_engine(connection_string):
+    """
+    Returns the process-wide engine for a connection string, creating it on
+    first use, so every caller shares one connection pool per database.
+    """
+    with _engines_lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            options = {"echo": False, "pool_pre_ping": True}
+            if not connection_string.startswith("sqlite"):
+                options.update(
+                    pool_size=POOL_SIZE,
+                    max_overflow=POOL_MAX_OVERFLOW,
+                    pool_recycle=POOL_RECYCLE,
+                )
+            engine = create_engine(connection_string, **options)
+            _engines[connection_string] = engine
+        return engine
+
 def create_db_engine(db_type, host, port, user, password, database):
-    """Creates and returns a SQLAlchemy engine."""
+    """Returns the (shared) SQLAlchemy engine for the given connection parameters."""
     connection_string = get_connection_string(db_type, host, port, user, password, database)
-    engine = create_engine(connection_string, echo=False)
-    return engine
+    return get_engine(connection_string)
 
 def test_connection(engine):
     """Tests the database connection."""
@@ -28,20 +81,88 @@ def test_connection(engine):
     except Exception as e:
         return False, str(e)
 
+def _row_estimates(engine):
+    """Returns {table: estimated row count} from the database statistics, if available."""
+    dialect = engine.dialect.name
+    if dialect == "mysql":
+        query = "SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+    elif dialect == "postgresql":
+        query = """
+            SELECT c.relname, c.reltuples::bigint FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+        """
+    else:
+        return {}
+    with engine.connect() as connection:
+        # reltuples is -1 for tables that were never analyzed
+        return {name: int(rows) for name, rows in connection.execute(text(query)) if rows is not None and rows >= 0}
+
+def reflect_schema(engine):
+    """Reflects tables, columns, types and row estimates from the database."""
+    inspector = inspect(engine)
+    columns = inspector.get_multi_columns()
+    estimates = _row_estimates(engine)
+    catalog = {}
+    for (_, table), table_columns in sorted(columns.items(), key=lambda item: item[0][1]):
+        catalog[table] = {
+            "columns": [(c["name"], str(c["type"])) for c in table_columns],
+            "rows": estimates.get(table),
+        }
+    return catalog
+
+def get_schema_catalog(engine, refresh=False):
+    """
+    Returns {table: {"columns": [(name, type)], "rows": estimate or None}},
+    reflected at most once per SCHEMA_CACHE_TTL seconds for each engine.
+    Shared by the sidebar and the agent, so reruns don't query the schema.
+    """
+    with _catalogs_lock:
+        cached = _catalogs.get(engine)
+        if cached and not refresh and cached[0] > time.monotonic():
+            return cached[1]
+
+    catalog = reflect_schema(engine)
+    with _catalogs_lock:
+        _catalogs[engine] = (time.monotonic() + SCHEMA_CACHE_TTL, catalog)
+    return catalog
+
+def format_schema_catalog(catalog):
+    """Renders the schema catalog as compact text for the agent prompt."""
+    lines = []
+    for table, info in list(catalog.items())[:MAX_PROMPT_TABLES]:
+        rows = f" (~{info['rows']:,} rows)" if info["rows"] is not None else ""
+        columns = ", ".join(f"{name} {type_}" for name, type_ in info["columns"])
+        lines.append(f"{table}{rows}: {columns}")
+    if len(catalog) > MAX_PROMPT_TABLES:
+        lines.append(f"... {len(catalog) - MAX_PROMPT_TABLES} more tables")
+    return "\n".join(lines)
+
 def get_tables(engine):
     """Returns a list of table names in the database."""
-    inspector = inspect(engine)
-    return inspector.get_table_names()
+    return list(get_schema_catalog(engine))
 
 def load_table(engine, table_name, limit=None):
     """Loads a table into a Pandas DataFrame."""
     query = f"SELECT * FROM {table_name}"
     if limit:
         query += f" LIMIT {limit}"
-    return pd.read_sql(query, engine)
+    with span("load_table", table=table_name, limit=limit) as load_span:
+        df = pd.read_sql(query, engine)
+        # Profile once at load time so the agent prompt gets it from the cache
+        get_profile(df)
+        load_span.set(rows=len(df))
+    return df
 
 def get_storage_engine():
-    """Creates an engine for the storage database (TiDB) using env vars."""
+    """
+    Returns the engine for the storage database (TiDB) configured by env vars.
+    AUTOANALYTX_STORAGE_URL, if set, overrides them with any SQLAlchemy URL
+    (e.g. a local SQLite file for development and benchmarks).
+    """
+    url = os.getenv("AUTOANALYTX_STORAGE_URL")
+    if url:
+        return get_engine(url)
     user = os.getenv("TIDB_USER", "root")
     password = os.getenv("TIDB_PASSWORD", "")
     host = os.getenv("TIDB_HOST", "127.0.0.1")
@@ -49,25 +170,122 @@ def get_storage_engine():
     database = os.getenv("TIDB_DATABASE", "autoanalytx")
     
     connection_string = f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
-    return create_engine(connection_string, echo=False)
+    return get_engine(connection_string)
+
+# Inserts performed by the write-behind queue, by table.
+STORAGE_INSERTS = {
+    "saved_analyses": text("""
+        INSERT INTO saved_analyses (user_id, query, result_summary, visualization_json)
+        VALUES (:user_id, :query, :result_summary, :visualization_json)
+    """),
+    "conversation_messages": text("""
+        INSERT INTO conversation_messages (user_id, session_id, role, content)
+        VALUES (:user_id, :session_id, :role, :content)
+    """),
+}
+WRITE_BATCH_SIZE = int(os.getenv("AUTOANALYTX_WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("AUTOANALYTX_WRITE_FLUSH_INTERVAL", "2"))
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """Returns the process-wide write-behind queue for the storage database."""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteBehindQueue(
+                get_storage_engine,
+                STORAGE_INSERTS,
+                batch_size=WRITE_BATCH_SIZE,
+                flush_interval=WRITE_FLUSH_INTERVAL,
+            )
+        return _write_queue
 
 def save_analysis(user_id, query, result_summary, visualization_json=None):
-    """Saves an analysis result to the storage database."""
-    try:
-        engine = get_storage_engine()
-        with engine.connect() as connection:
-            query_sql = text("""
-                INSERT INTO saved_analyses (user_id, query, result_summary, visualization_json)
-                VALUES (:user_id, :query, :result_summary, :visualization_json)
-            """)
-            connection.execute(query_sql, {
-                "user_id": user_id,
-                "query": query,
-                "result_summary": result_summary,
-                "visualization_json": visualization_json
-            })
-            connection.commit()
-    except Exception as e:
-        st.error(f"Failed to save to storage DB: {e}") 
+    """Queues an analysis result for the storage database; written in the background."""
+    with span("save_analysis"):
+        get_write_queue().put("saved_analyses", {
+            "user_id": user_id,
+            "query": query,
+            "result_summary": result_summary,
+            "visualization_json": visualization_json
+        })
+
+def save_message(user_id, session_id, role, content):
+    """Queues a conversation message for the storage database; written in the background."""
+    get_write_queue().put("conversation_messages", {
+        "user_id": user_id,
+        "session_id": session_id,
+        "role": role,
+        "content": content,
+    })
+
+def validate_readonly_sql(sql: str) -> str:
+    """
+    Checks that `sql` is a single read-only statement and returns it without
+    a trailing semicolon. Raises ValueError otherwise. Keywords are checked
+    outside of string literals, quoted identifiers and comments.
+    """
+    statement = sql.strip().rstrip(";").strip()
+    code = _SQL_LITERALS.sub(" ", statement)
+    if ";" in code:
+        raise ValueError("Only a single SQL statement is allowed.")
+    words = code.split()
+    if not words or words[0].lower() not in _READ_ONLY_STATEMENTS:
+        raise ValueError("Only read-only statements (SELECT, WITH, SHOW, DESCRIBE, EXPLAIN) are allowed.")
+    match = _WRITE_KEYWORDS.search(code)
+    if match:
+        raise ValueError(f"'{match.group(0)}' is not allowed in a read-only query.")
+    return statement
+
+def run_readonly_query(engine, sql, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT):
+    """
+    Runs an agent-written query in a read-only transaction with a statement
+    timeout, fetching at most `max_rows` rows (plus one, to detect truncation).
+    Returns (DataFrame, truncated) where `truncated` tells whether the result
+    had more rows than `max_rows`. SQLite has no statement timeout.
+
+    The query is not wrapped in a derived table, which MySQL rejects when the
+    select list has duplicate column names (e.g. `SELECT *` over a join). On
+    MySQL/TiDB the server caps the rows with `sql_select_limit`; mysqlconnector
+    has no server-side cursors, so the capped result is buffered client-side.
+    PostgreSQL uses a server-side cursor and SQLite steps lazily, so there
+    `fetchmany` stops the transfer after the cap.
+    """
+    statement = validate_readonly_sql(sql)
+
+    dialect = engine.dialect.name
+    timeout_ms = int(timeout * 1000)
+    with engine.connect() as connection:
+        try:
+            if dialect == "postgresql":
+                connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+            elif dialect == "mysql":
+                # Also covers TiDB; all are reset before the connection returns to the pool
+                connection.exec_driver_sql(f"SET SESSION max_execution_time = {timeout_ms}")
+                connection.exec_driver_sql(f"SET SESSION sql_select_limit = {int(max_rows) + 1}")
+                connection.exec_driver_sql("START TRANSACTION READ ONLY")
+            elif dialect == "sqlite":
+                connection.exec_driver_sql("PRAGMA query_only = ON")
 
+            result = connection.execution_options(stream_results=True, max_row_buffer=SQL_FETCH_SIZE).execute(text(statement))
+            columns = list(result.keys())
+            rows = []
+            while len(rows) <= max_rows:
+                batch = result.fetchmany(SQL_FETCH_SIZE)
+                if not batch:
+                    break
+                rows.extend(batch)
+            result.close()
+        finally:
+            connection.rollback()
+            if dialect == "mysql":
+                connection.exec_driver_sql("SET SESSION max_execution_time = 0")
+                connection.exec_driver_sql("SET SESSION sql_select_limit = DEFAULT")
+            elif dialect == "sqlite":
+                connection.exec_driver_sql("PRAGMA query_only = OFF")
 
+    truncated = len(rows) > max_rows
+    return pd.DataFrame([tuple(r) for r in rows[:max_rows]], columns=columns), truncated
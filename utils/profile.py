@@ -0,0 +1,216 @@
+import hashlib
+import threading
+import weakref
+from collections import Counter, OrderedDict
+
+import pandas as pd
+
+# Number of profiles kept in memory, least recently used evicted first.
+PROFILE_CACHE_SIZE = 32
+# Rows shown in the sample section of the profile.
+SAMPLE_ROWS = 3
+# Most frequent values listed for non-numeric columns.
+TOP_VALUES = 3
+# Columns described in the prompt before the rest are summarized in one line.
+MAX_PROMPT_COLUMNS = 60
+MAX_CELL_CHARS = 40
+# Distinct values tracked per column when profiling a file in chunks.
+MAX_TRACKED_UNIQUE = 10_000
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+# id(df) -> (schema, fingerprint) of live DataFrames, dropped when the frame is collected.
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def fingerprint_dataframe(df: pd.DataFrame) -> str:
+    """
+    Returns a content fingerprint: shape, schema and a hash of every row, so
+    any changed cell changes it.
+    Hashing is linear in the size of the frame, so the result is memoized per
+    DataFrame object: the prompt is built on every agent iteration, while
+    loaded frames are never modified in place (agent code gets copy-on-write
+    copies). A changed shape or schema is still noticed.
+    """
+    schema = repr((df.shape, [str(c) for c in df.columns], [str(t) for t in df.dtypes]))
+    with _fingerprints_lock:
+        cached = _fingerprints.get(id(df))
+    if cached is not None and cached[0] == schema:
+        return cached[1]
+
+    fingerprint = _hash_dataframe(df, schema)
+    with _fingerprints_lock:
+        if id(df) not in _fingerprints:
+            try:
+                weakref.finalize(df, _fingerprints.pop, id(df), None)
+            except TypeError:
+                return fingerprint  # Not weak-referenceable: not memoized
+        _fingerprints[id(df)] = (schema, fingerprint)
+    return fingerprint
+
+def _hash_dataframe(df: pd.DataFrame, schema: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(schema.encode())
+    if len(df):
+        try:
+            hashed = pd.util.hash_pandas_object(df, index=True)
+        except TypeError:
+            # Unhashable cells (lists, dicts, ...)
+            hashed = pd.util.hash_pandas_object(df.astype(str), index=True)
+        digest.update(hashed.values.tobytes())
+    return digest.hexdigest()
+
+def _short(value) -> str:
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 3] + "..."
+
+def profile_dataframe(df: pd.DataFrame) -> dict:
+    """Computes schema, dtypes, null counts, cardinalities, numeric summaries and a sample."""
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        column = {
+            "name": str(name),
+            "dtype": str(series.dtype),
+            "nulls": int(series.isna().sum()),
+        }
+        try:
+            column["unique"] = int(series.nunique(dropna=True))
+        except TypeError:
+            column["unique"] = None
+
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            described = series.describe()
+            column["summary"] = {
+                stat: float(described[stat])
+                for stat in ("min", "max", "mean", "std")
+                if stat in described and pd.notna(described[stat])
+            }
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            column["summary"] = {"min": str(series.min()), "max": str(series.max())}
+        else:
+            try:
+                top = series.value_counts(dropna=True).head(TOP_VALUES)
+                column["top"] = [_short(v) for v in top.index]
+            except TypeError:
+                column["top"] = []
+        columns.append(column)
+
+    return {
+        "rows": int(len(df)),
+        "columns": columns,
+        "sample": df.head(SAMPLE_ROWS).to_string(max_colwidth=MAX_CELL_CHARS, max_cols=MAX_PROMPT_COLUMNS),
+    }
+
+def get_profile(df: pd.DataFrame) -> dict:
+    """Returns the profile of `df`, computed once per data fingerprint."""
+    key = fingerprint_dataframe(df)
+    with _profiles_lock:
+        if key in _profiles:
+            _profiles.move_to_end(key)
+            return _profiles[key]
+
+    profile = profile_dataframe(df)
+    profile["fingerprint"] = key
+    with _profiles_lock:
+        _profiles[key] = profile
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+def profile_csv(path: str, chunksize: int = 200_000) -> dict:
+    """
+    Profiles a CSV file chunk by chunk, with memory bounded by `chunksize`.
+    Produces the same structure as `profile_dataframe`; numeric summaries are
+    merged exactly and distinct counts are exact up to MAX_TRACKED_UNIQUE.
+    """
+    rows = 0
+    sample = None
+    stats = {}
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if sample is None:
+            sample = chunk.head(SAMPLE_ROWS).to_string(max_colwidth=MAX_CELL_CHARS, max_cols=MAX_PROMPT_COLUMNS)
+        rows += len(chunk)
+        for name in chunk.columns:
+            series = chunk[name]
+            column = stats.setdefault(name, {
+                "dtype": str(series.dtype), "nulls": 0, "count": 0, "sum": 0.0, "sumsq": 0.0,
+                "min": None, "max": None, "values": Counter(), "capped": False,
+            })
+            if column["dtype"] != str(series.dtype):
+                # e.g. an int column that gains nulls (float) or text (object) later on
+                column["dtype"] = str(pd.concat([series.head(0), pd.Series(dtype=column["dtype"])]).dtype)
+            column["nulls"] += int(series.isna().sum())
+
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                values = series.dropna().astype(float)
+                if len(values):
+                    column["count"] += len(values)
+                    column["sum"] += float(values.sum())
+                    column["sumsq"] += float((values ** 2).sum())
+                    low, high = float(values.min()), float(values.max())
+                    column["min"] = low if column["min"] is None else min(column["min"], low)
+                    column["max"] = high if column["max"] is None else max(column["max"], high)
+            if not column["capped"]:
+                try:
+                    column["values"].update(series.dropna().value_counts().to_dict())
+                except TypeError:
+                    column["capped"] = True
+                if len(column["values"]) > MAX_TRACKED_UNIQUE:
+                    column["capped"] = True
+
+    columns = []
+    for name, column in stats.items():
+        entry = {"name": str(name), "dtype": column["dtype"], "nulls": column["nulls"]}
+        entry["unique"] = f">{MAX_TRACKED_UNIQUE}" if column["capped"] else len(column["values"])
+        if column["count"] and pd.api.types.is_numeric_dtype(pd.Series(dtype=column["dtype"])):
+            count = column["count"]
+            mean = column["sum"] / count
+            # Sample variance, matching DataFrame.describe()
+            variance = max(column["sumsq"] - count * mean ** 2, 0.0) / (count - 1) if count > 1 else 0.0
+            entry["summary"] = {"min": column["min"], "max": column["max"], "mean": mean, "std": variance ** 0.5}
+        else:
+            entry["top"] = [_short(v) for v, _ in column["values"].most_common(TOP_VALUES)]
+        columns.append(entry)
+
+    return {"rows": rows, "columns": columns, "sample": sample or ""}
+
+def _format_number(value: float) -> str:
+    return f"{value:.4g}"
+
+def format_profile(name: str, profile: dict) -> str:
+    """Renders a profile as compact text for the system prompt."""
+    columns = profile["columns"]
+    lines = [f"Dataframe `{name}`: {profile['rows']:,} rows x {len(columns)} columns"]
+    lines.append("column | dtype | nulls | unique | summary")
+    for column in columns[:MAX_PROMPT_COLUMNS]:
+        if "summary" in column:
+            summary = " ".join(
+                f"{stat}={_format_number(v) if isinstance(v, float) else v}"
+                for stat, v in column["summary"].items()
+            )
+        else:
+            summary = "top: " + ", ".join(column.get("top", []))
+        unique = "?" if column["unique"] is None else column["unique"]
+        lines.append(f"{column['name']} | {column['dtype']} | {column['nulls']} | {unique} | {summary}")
+    if len(columns) > MAX_PROMPT_COLUMNS:
+        rest = ", ".join(c["name"] for c in columns[MAX_PROMPT_COLUMNS:])
+        lines.append(f"... {len(columns) - MAX_PROMPT_COLUMNS} more columns: {rest}")
+    lines.append("Sample rows:")
+    lines.append(profile["sample"])
+    return "\n".join(lines)
+
+def describe_dataframes(dataframes: dict) -> str:
+    """Returns the compact profile of every loaded dataframe, for the system prompt.
+    Out-of-core datasets (e.g. `utils.streaming.CsvDataset`) provide their own
+    precomputed `profile` and a `usage` note telling the agent how to query them.
+    """
+    if not dataframes:
+        return "No dataset is loaded yet."
+    sections = []
+    for name, data in dataframes.items():
+        if isinstance(data, pd.DataFrame):
+            sections.append(format_profile(name, get_profile(data)))
+        elif getattr(data, "profile", None) is not None:
+            sections.append(format_profile(name, data.profile) + "\n" + data.usage(name))
+    return "\n\n".join(sections)
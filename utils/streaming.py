@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import weakref
+
+import duckdb
+import pandas as pd
+
+from utils.profile import profile_csv
+
+# CSV uploads above this size are opened in streaming mode instead of loaded.
+STREAMING_THRESHOLD_MB = int(os.getenv("AUTOANALYTX_STREAMING_THRESHOLD_MB", "200"))
+# Memory DuckDB may use for one query before spilling to disk.
+DUCKDB_MEMORY_LIMIT = os.getenv("AUTOANALYTX_DUCKDB_MEMORY_LIMIT", "1GB")
+CHUNK_ROWS = 200_000
+
+# Handles alive in this process (sessions, sandbox assignments), whose files
+# must stay on disk.
+_live_datasets = weakref.WeakSet()
+_live_lock = threading.Lock()
+
+def _quote(path: str) -> str:
+    return "'" + path.replace("'", "''") + "'"
+
+class CsvDataset:
+    """
+    Out-of-core handle on a CSV file too large to load as a DataFrame.
+    The rows live in an on-disk DuckDB table named `data`, so SQL queries run
+    with bounded memory and only their results are materialized in pandas.
+    The handle is picklable (it reconnects lazily), so it can be shipped to
+    sandbox workers like a DataFrame.
+    """
+
+    def __init__(self, csv_path: str, db_path: str, profile: dict):
+        self.csv_path = csv_path
+        self.db_path = db_path
+        self.profile = profile
+        self._con = None
+        self._lock = threading.Lock()
+        _register(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_con"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        _register(self)
+
+    def __repr__(self):
+        return f"<CsvDataset {os.path.basename(self.csv_path)}: {len(self):,} rows, table `data`>"
+
+    def __len__(self):
+        return self.profile["rows"]
+
+    @property
+    def columns(self) -> list:
+        return [c["name"] for c in self.profile["columns"]]
+
+    def _cursor(self):
+        with self._lock:
+            if self._con is None:
+                self._con = duckdb.connect(self.db_path, read_only=True)
+                self._con.execute(f"SET memory_limit = {_quote(DUCKDB_MEMORY_LIMIT)}")
+            # Cursors are independent connections, safe to use from several threads
+            return self._con.cursor()
+
+    def sql(self, query: str) -> pd.DataFrame:
+        """Runs a DuckDB SQL query against the table `data` and returns the result."""
+        cursor = self._cursor()
+        try:
+            return cursor.sql(query).df()
+        finally:
+            cursor.close()
+
+    def relation(self):
+        """Returns a lazy DuckDB relation over the table `data`."""
+        return self._cursor().table("data")
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.sql(f"SELECT * FROM data LIMIT {int(n)}")
+
+    def chunks(self, chunksize: int = CHUNK_ROWS, **kwargs):
+        """Iterates over the raw CSV as DataFrames of `chunksize` rows."""
+        return pd.read_csv(self.csv_path, chunksize=chunksize, **kwargs)
+
+    def usage(self, name: str) -> str:
+        """Explains to the agent how to query the dataset."""
+        return (
+            f"`{name}` is too large to load as a DataFrame. It is an out-of-core handle: "
+            f"use `{name}.sql(\"SELECT ... FROM data ...\")` (DuckDB SQL, returns a pandas DataFrame) "
+            f"for filters and aggregations, `{name}.head(n)` for rows, or "
+            f"`for chunk in {name}.chunks(): ...` to process it in pandas chunks. "
+            "Never materialize the whole table."
+        )
+
+def _register(dataset: CsvDataset):
+    with _live_lock:
+        _live_datasets.add(dataset)
+
+def live_dataset_paths() -> set:
+    """Returns the CSV and DuckDB files of the CsvDataset handles still referenced in this process."""
+    with _live_lock:
+        datasets = list(_live_datasets)
+    return {path for dataset in datasets for path in (dataset.csv_path, dataset.db_path)}
+
+def open_csv_dataset(csv_path: str) -> CsvDataset:
+    """
+    Opens a CSV file in streaming mode: imports it into an on-disk DuckDB
+    table next to it and profiles it chunk by chunk. Both are done once and
+    kept on disk for later opens of the same file.
+    """
+    base_path = os.path.splitext(csv_path)[0]
+    db_path = base_path + ".duckdb"
+    profile_path = base_path + ".profile.json"
+    tmp_suffix = f".{threading.get_ident()}.tmp"
+
+    if not os.path.exists(db_path):
+        con = duckdb.connect(db_path + tmp_suffix)
+        try:
+            con.execute(f"SET memory_limit = {_quote(DUCKDB_MEMORY_LIMIT)}")
+            con.execute(f"CREATE TABLE data AS SELECT * FROM read_csv_auto({_quote(csv_path)})")
+        finally:
+            con.close()
+        os.replace(db_path + tmp_suffix, db_path)
+
+    if os.path.exists(profile_path):
+        with open(profile_path) as f:
+            profile = json.load(f)
+    else:
+        profile = profile_csv(csv_path, chunksize=CHUNK_ROWS)
+        with open(profile_path + tmp_suffix, "w") as f:
+            json.dump(profile, f)
+        os.replace(profile_path + tmp_suffix, profile_path)
+
+    return CsvDataset(csv_path, db_path, profile)
@@ -0,0 +1,198 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import psutil
+
+# JSONL file that finished traces are appended to, one span per line.
+TRACE_FILE = os.getenv("AUTOANALYTX_TRACE_FILE")
+# Finished traces kept in memory for the debug panel.
+RECENT_TRACES = 50
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_recent = deque(maxlen=RECENT_TRACES)
+_recent_lock = threading.Lock()
+_export_lock = threading.Lock()
+_process = psutil.Process()
+
+def rss_mb() -> float:
+    """Current resident memory of this process, in MB."""
+    return _process.memory_info().rss / 1024 / 1024
+
+class Span:
+    """
+    One timed operation. Attributes can be added while it runs. Memory is
+    sampled at start and end, so `peak_rss_mb` misses spikes in between.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._rss_start = rss_mb()
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def finish(self, error: BaseException = None):
+        self.end_ns = time.time_ns()
+        self.attributes["duration_ms"] = (time.perf_counter() - self._start) * 1000
+        # CPU of the calling thread, plus that of a sandbox worker if one ran code for the span
+        cpu_ms = (time.thread_time() - self._cpu_start) * 1000
+        self.attributes["cpu_ms"] = cpu_ms + self.attributes.get("worker_cpu_ms", 0)
+        rss_end = rss_mb()
+        self.attributes["rss_mb"] = rss_end
+        self.attributes["rss_delta_mb"] = rss_end - self._rss_start
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        return self.attributes.get("duration_ms", 0.0)
+
+    @property
+    def peak_rss_mb(self) -> float:
+        return max(self._rss_start, self.attributes.get("rss_mb", self._rss_start))
+
+    @property
+    def worker_peak_rss_mb(self):
+        """Sampled peak memory of the sandbox worker that ran code for the span, if any."""
+        end = self.attributes.get("worker_rss_mb")
+        if end is None:
+            return None
+        return max(end, end - self.attributes.get("worker_rss_delta_mb", 0))
+
+    def to_dict(self) -> dict:
+        """Renders the span with OpenTelemetry (OTLP JSON) field names."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "status": {"code": "STATUS_CODE_ERROR" if self.status == "error" else "STATUS_CODE_OK"},
+            "attributes": self.attributes,
+        }
+
+class Trace:
+    """The spans of one unit of work, usually a chat turn."""
+
+    def __init__(self, name: str, attributes: dict = None):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, self.trace_id, attributes=attributes)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> dict:
+        """Aggregates the turn: wall time, LLM time and tokens, iterations, tool CPU, DB time, memory."""
+        with self._lock:
+            spans = list(self.spans)
+        llm = [s for s in spans if s.name == "agent_node"]
+        tools = [s for s in spans if s.name in ("execute_python", "run_sql")]
+        db = [s for s in spans if s.name in ("run_sql", "load_table", "save_analysis", "storage_write")]
+        worker_rss = [s.worker_peak_rss_mb for s in tools if s.worker_peak_rss_mb is not None]
+        return {
+            "wall_ms": self.root.duration_ms,
+            "iterations": len(llm),
+            "llm_ms": sum(s.duration_ms for s in llm),
+            "input_tokens": sum(s.attributes.get("input_tokens", 0) for s in llm),
+            "output_tokens": sum(s.attributes.get("output_tokens", 0) for s in llm),
+            "tool_calls": len(tools),
+            "tool_ms": sum(s.duration_ms for s in tools),
+            "tool_cpu_ms": sum(s.attributes.get("cpu_ms", 0) for s in tools),
+            "db_ms": sum(s.duration_ms for s in db),
+            "peak_rss_mb": max(s.peak_rss_mb for s in [self.root] + spans),
+            "worker_peak_rss_mb": max(worker_rss) if worker_rss else None,
+        }
+
+    def to_dicts(self) -> list:
+        with self._lock:
+            return [self.root.to_dict()] + [s.to_dict() for s in self.spans]
+
+def _export(trace: Trace):
+    with _recent_lock:
+        _recent.append(trace)
+    if TRACE_FILE:
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in trace.to_dicts())
+        with _export_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+@contextlib.contextmanager
+def trace(name: str, **attributes):
+    """
+    Starts a trace (e.g. one chat turn). Spans opened in this context, and in
+    threads or tasks that copy it, are recorded in the trace. On exit the
+    trace is kept for `recent_traces` and appended to TRACE_FILE if set.
+    """
+    current = Trace(name, attributes)
+    trace_token = _current_trace.set(current)
+    span_token = _current_span.set(current.root)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        current.root.finish(error)
+        current.root.set(**current.summary())
+        _export(current)
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Times an operation inside the current trace. Outside of a trace the span
+    becomes a trace of its own, so background work (loads, writes) is still
+    recorded. Yields the Span so callers can add attributes.
+    """
+    current = _current_trace.get()
+    if current is None:
+        with trace(name, **attributes) as standalone:
+            yield standalone.root
+        return
+
+    parent = _current_span.get()
+    new_span = Span(name, current.trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(new_span)
+    error = None
+    try:
+        yield new_span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.finish(error)
+        current.add(new_span)
+
+def annotate(**attributes):
+    """Adds attributes to the innermost open span; does nothing outside of one."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+def recent_traces(name: str = None) -> list:
+    """Returns the finished traces kept in memory, newest last, optionally filtered by name."""
+    with _recent_lock:
+        return [t for t in _recent if name is None or t.root.name == name]
@@ -0,0 +1,175 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import DataError, DisconnectionError, IntegrityError, OperationalError
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_FLUSH = "flush"
+_STOP = "stop"
+
+# Errors worth retrying: the connection or server, not the rows themselves.
+_TRANSIENT_ERRORS = (OperationalError, DisconnectionError)
+# Errors caused by individual rows (constraints, bad values).
+_ROW_ERRORS = (IntegrityError, DataError)
+
+class WriteBehindQueue:
+    """
+    Buffers rows bound for the storage database and inserts them from a
+    background thread, so the request path never waits on a round trip.
+    Rows are written per table in multi-row batches once `batch_size` rows are
+    buffered or `flush_interval` seconds after the first one arrived. Batches
+    that hit a connection error are retried with exponential backoff; when a
+    row violates a constraint the batch is written row by row, so only the
+    bad rows are dropped. The queue is flushed on interpreter shutdown.
+    """
+
+    def __init__(self, engine_factory, statements: dict, batch_size: int = 100,
+                 flush_interval: float = 2.0, max_retries: int = 5, backoff: float = 0.5):
+        self._engine_factory = engine_factory
+        self._statements = statements
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._queue = queue.Queue()
+        self._buffered = 0
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "rows_enqueued": 0,
+            "rows_written": 0,
+            "rows_failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": None,
+        }
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="autoanalytx-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, table: str, row: dict):
+        """Queues one row for `table`; returns immediately."""
+        if table not in self._statements:
+            raise ValueError(f"No insert statement registered for table: {table}")
+        self._ensure_started()
+        with self._metrics_lock:
+            self._metrics["rows_enqueued"] += 1
+        self._queue.put((table, row))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Writes everything queued so far; returns False if `timeout` expired first."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10):
+        """Flushes the queue and stops the background thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put((_STOP, done))
+        done.wait(timeout)
+
+    def metrics(self) -> dict:
+        """Returns the queue depth, row and batch counters, and flush latencies."""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize() + self._buffered
+        return metrics
+
+    def _run(self):
+        buffer = []
+        deadline = None
+        while True:
+            timeout = None if not buffer else max(0.0, deadline - time.monotonic())
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = None, None  # The flush interval elapsed
+
+            if kind in (_FLUSH, _STOP):
+                self._write_all(buffer)
+                buffer = []
+                self._buffered = 0
+                payload.set()
+                if kind == _STOP:
+                    return
+                continue
+
+            if kind is not None:
+                if not buffer:
+                    deadline = time.monotonic() + self.flush_interval
+                buffer.append((kind, payload))
+                self._buffered = len(buffer)
+                if len(buffer) < self.batch_size:
+                    continue
+
+            self._write_all(buffer)
+            buffer = []
+            self._buffered = 0
+
+    def _write_all(self, buffer):
+        by_table = {}
+        for table, row in buffer:
+            by_table.setdefault(table, []).append(row)
+        for table, rows in by_table.items():
+            self._write_batch(table, rows)
+
+    def _execute(self, table, rows):
+        """Inserts `rows` in one transaction, retrying transient errors; re-raises anything else."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                engine = self._engine_factory()
+                with span("storage_write", table=table, rows=len(rows), attempt=attempt), engine.begin() as connection:
+                    # A list of parameter sets is sent as one executemany / multi-row INSERT
+                    connection.execute(self._statements[table], rows)
+                return
+            except _TRANSIENT_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                with self._metrics_lock:
+                    self._metrics["retries"] += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _write_batch(self, table, rows):
+        start = time.perf_counter()
+        written = 0
+        try:
+            self._execute(table, rows)
+            written = len(rows)
+        except _ROW_ERRORS:
+            if len(rows) == 1:
+                logger.exception("Dropping a row for %s", table)
+            else:
+                # The transaction was rolled back; keep the valid rows by inserting one at a time
+                for row in rows:
+                    try:
+                        self._execute(table, [row])
+                        written += 1
+                    except Exception:
+                        logger.exception("Dropping a row for %s", table)
+        except Exception:
+            logger.exception("Dropping %d rows for %s", len(rows), table)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._metrics_lock:
+            self._metrics["rows_written"] += written
+            self._metrics["rows_failed"] += len(rows) - written
+            self._metrics["batches"] += 1
+            self._metrics["last_flush_ms"] = elapsed_ms
+            self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"] or 0, elapsed_ms)